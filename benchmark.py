@@ -0,0 +1,312 @@
+"""Times and memory-profiles every stage of SingleModel.predict on synthetic exposure pairs.
+
+The networks have random weights, so no checkpoint is needed and the numbers only describe speed.
+Each stage runs on the outputs of the stages before it, over a grid of sizes and batch sizes,
+after warm-up runs. GMFlow is split into feature extraction, each matching scale (transformer,
+correlation and propagation) and the final upsampling. Peak memory is the resident set size (or
+allocated CUDA memory) a stage reaches above what the process holds before it.
+
+    python benchmark.py run --sizes 256x384,512x768 --batch_sizes 1,2 --output baseline.json
+    python benchmark.py compare baseline.json current.json --threshold 0.1
+
+compare exits with status 1 when the median time or the peak memory of a stage grew by more
+than the threshold. imports times how long a fresh interpreter takes to import what test.py
+executes, lists the slowest packages and any optional or training-only package loaded.
+
+    python benchmark.py imports --repeat 5
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from models import networks
+from models.instrumentation import peak_memory, reset_peak_memory, resident_memory
+from models.pipeline import MERFPipeline
+from models.single_model import latent2im
+
+# as in align_FG.estimate_flow
+FLOW_ATTN_SPLITS = [2, 8]
+FLOW_CORR_RADIUS = [-1, 4]
+FLOW_PROP_RADIUS = [-1, 4]
+
+# modules test.py imports, up front or on first use
+INFERENCE_MODULES = ['options.test_options', 'data.data_loader', 'data.custom_dataset_data_loader',
+                     'data.test_dataset', 'models.models', 'models.single_model', 'util.image_writer']
+# optional or training-only packages the inference path should not load
+DEFERRED_MODULES = ['timm', 'kornia', 'cv2', 'scipy', 'torchvision', 'pdb', 'matplotlib']
+
+IMPORT_PROBE = '''
+import sys, time
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+print(time.perf_counter() - start)
+print(' '.join(sorted(set(name.split('.')[0] for name in sys.modules))))
+'''
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def build_networks(device, corr_chunk_size=0):
+    # the five networks as SingleModel.initialize builds them in test mode, with random weights
+    opt = argparse.Namespace(device=device, gpu_ids=[], corr_chunk_size=corr_chunk_size)
+    nets = (networks.define_Att(device=device), networks.define_A(opt, test_mode=True),
+            networks.define_F(device=device), networks.define_G(window_size=4, device=device),
+            networks.define_R(device=device))
+    for net in nets:
+        net.eval()
+    nets[-1].fuse_for_inference()
+    return nets
+
+
+def flow_scale(flow_net, feature0, feature1, flow, attn_splits, corr_radius, prop_radius):
+    # one scale of GMFlow.forward_scales at inference
+    if flow is not None:
+        flow = F.interpolate(flow, scale_factor=2, mode='bilinear', align_corners=True) * 2
+    flow, feature0, feature1, _ = flow_net.match_scale(feature0, feature1, flow, attn_splits, corr_radius)
+    flow = flow_net.feature_flow_attn(feature0, flow, local_window_attn=prop_radius > 0,
+                                      local_window_radius=prop_radius, chunk_size=flow_net.corr_chunk_size)
+    return flow, feature0
+
+
+def stages(nets, input_A, input_B):
+    """Yields (name, function) for every stage of SingleModel.predict, in order.
+
+    The inputs of each function are the outputs of the stages yielded before it, computed once.
+    The last stage, 'total', is the whole pipeline.
+    """
+    mapping, align, dual_att, netG, refinement_net = nets
+    flow_net = networks.get_module(align).flow_net
+    avg_pool = torch.nn.AvgPool2d(2, 2)
+    up = torch.nn.Upsample(scale_factor=2, mode='bilinear', align_corners=True)
+
+    func = functools.partial(mapping, torch.cat((input_A, input_B), dim=0))
+    identity, correct = func()
+    identity_A, identity_B = identity.chunk(chunks=2, dim=0)
+    correct_A, correct_B = correct.chunk(chunks=2, dim=0)
+    yield 'mapping', func
+
+    func = functools.partial(flow_net.extract_feature, correct_A, correct_B)
+    feature0_list, feature1_list = func()
+    yield 'flow.features', func
+
+    flow = None
+    for scale_idx in range(flow_net.num_scales):
+        func = functools.partial(flow_scale, flow_net, feature0_list[scale_idx], feature1_list[scale_idx], flow,
+                                 FLOW_ATTN_SPLITS[scale_idx], FLOW_CORR_RADIUS[scale_idx], FLOW_PROP_RADIUS[scale_idx])
+        flow, feature0 = func()
+        yield 'flow.scale%d' % scale_idx, func
+
+    func = functools.partial(flow_net.upsample_flow, flow, feature0)
+    flow = func()
+    yield 'flow.upsample', func
+
+    func = functools.partial(networks.flow_warp2, identity_B, flow.permute(0, 2, 3, 1))
+    align_B = func()
+    yield 'warp', func
+
+    func = functools.partial(dual_att, align_B, identity_A)
+    align_B, align_A = func()
+    yield 'fuse', func
+
+    func = functools.partial(netG, avg_pool(align_B), avg_pool(align_A))
+    o_lf, x_lf = func()
+    yield 'swin', func
+
+    func = functools.partial(refinement_net, align_B, align_A, up(x_lf))
+    refinement = func() + up(o_lf)
+    yield 'refine', func
+
+    func = functools.partial(latent2im, refinement)
+    yield 'latent2im', func
+
+    pipeline = MERFPipeline(*nets).eval()
+    yield 'total', lambda: latent2im(pipeline(input_A, input_B))
+
+
+def measure(func, device, warmup, repeat):
+    for _ in range(warmup):
+        func()
+    synchronize(device)
+
+    reset_peak_memory(device)
+    base_memory = resident_memory(device)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+    # in MB
+    return times, (peak_memory(device) - base_memory) / 1024. / 1024.
+
+
+def summarize(times, percentiles):
+    stats = {'median': float(np.median(times)), 'mean': float(np.mean(times)),
+             'min': float(np.min(times)), 'max': float(np.max(times))}
+    for p in percentiles:
+        stats['p%g' % p] = float(np.percentile(times, p))
+    return stats
+
+
+def parse_list(value, item=int):
+    return [item(v) for v in value.split(',') if v]
+
+
+def run(args):
+    device = torch.device(args.device)
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    nets = build_networks(device, args.corr_chunk_size)
+    percentiles = parse_list(args.percentiles, float)
+
+    results = []
+    print('%-14s %10s %6s %12s %12s %12s' % ('stage', 'size', 'batch', 'median (ms)',
+                                            'p%g (ms)' % percentiles[-1], 'peak (MB)'))
+    for size in parse_list(args.sizes, str):
+        height, width = [int(s) for s in size.split('x')]
+        assert height % 32 == 0 and width % 32 == 0, 'sizes should be multiples of 32'
+        for batch_size in parse_list(args.batch_sizes):
+            input_A = torch.rand(batch_size, 3, height, width, device=device)
+            input_B = torch.rand(batch_size, 3, height, width, device=device)
+            with torch.no_grad():
+                for name, func in stages(nets, input_A, input_B):
+                    times, memory = measure(func, device, args.warmup, args.repeat)
+                    stats = summarize(times, percentiles)
+                    results.append(dict(stage=name, size=size, batch_size=batch_size,
+                                        times=times, peak_memory_mb=memory, **stats))
+                    print('%-14s %10s %6d %12.1f %12.1f %12.1f' % (name, size, batch_size, stats['median'] * 1000,
+                                                                  stats['p%g' % percentiles[-1]] * 1000, memory))
+
+    if args.output:
+        meta = {'torch': torch.__version__, 'python': platform.python_version(), 'machine': platform.machine(),
+                'processor': platform.processor(), 'threads': torch.get_num_threads(), 'device': str(device),
+                'warmup': args.warmup, 'repeat': args.repeat, 'corr_chunk_size': args.corr_chunk_size,
+                'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+        print('results written to %s' % args.output)
+    return results
+
+
+def import_time(modules, importtime=False):
+    # seconds a fresh interpreter takes to import modules, the top-level packages it loaded and the
+    # -X importtime report
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', IMPORT_PROBE] + modules
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    seconds, loaded = result.stdout.strip().split('\n')[-2:]
+    return float(seconds), set(loaded.split()), result.stderr
+
+
+def imports(args):
+    modules = parse_list(args.modules, str) or INFERENCE_MODULES
+    import_time(modules)  # warm the file system cache
+    times = [import_time(modules)[0] for _ in range(args.repeat)]
+    _, loaded, report = import_time(modules, importtime=True)
+
+    # lines of -X importtime read "import time: self [us] | cumulative [us] | <indent>module", the
+    # cumulative time of a package without a dot is that of its first import, wherever it happens
+    packages = []
+    for line in report.split('\n'):
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit() and '.' not in fields[2]:
+            packages.append((int(fields[1]) / 1e6, fields[2].strip()))
+    packages.sort(reverse=True)
+
+    print('import of %s: median %.3fs, min %.3fs over %d runs' % (', '.join(modules), np.median(times),
+                                                                  np.min(times), args.repeat))
+    print('slowest packages (with -X importtime):')
+    for seconds, name in packages[:args.top]:
+        print('  %8.3fs  %s' % (seconds, name))
+    deferred = [name for name in DEFERRED_MODULES if name in loaded]
+    print('optional or training-only packages loaded: %s' % (', '.join(deferred) or 'none'))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'modules': modules, 'times': times, 'median': float(np.median(times)),
+                       'packages': [{'name': name, 'seconds': seconds} for seconds, name in packages],
+                       'deferred_loaded': deferred}, f, indent=1)
+        print('results written to %s' % args.output)
+    return times, deferred
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    reference = dict(((r['stage'], r['size'], r['batch_size']), r) for r in baseline['results'])
+    regressions = 0
+    print('%-14s %10s %6s %14s %14s %8s %10s' % ('stage', 'size', 'batch', 'baseline (ms)', 'current (ms)',
+                                                'change', 'memory'))
+    for result in current['results']:
+        key = (result['stage'], result['size'], result['batch_size'])
+        if key not in reference:
+            continue
+        ref = reference[key]
+        change = result['median'] / ref['median'] - 1
+        memory_change = result['peak_memory_mb'] - ref['peak_memory_mb']
+        flags = []
+        if change > args.threshold:
+            flags.append('SLOWER')
+        if memory_change > max(args.memory_threshold * abs(ref['peak_memory_mb']), args.memory_slack):
+            flags.append('MORE MEMORY')
+        regressions += len(flags) > 0
+        print('%-14s %10s %6d %14.1f %14.1f %+7.1f%% %+9.1fM %s' % (key[0], key[1], key[2], ref['median'] * 1000,
+                                                                    result['median'] * 1000, change * 100,
+                                                                    memory_change, ' '.join(flags)))
+    print('%d regression(s) beyond %.0f%% time or %.0f%% memory' % (regressions, args.threshold * 100,
+                                                                   args.memory_threshold * 100))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='per-stage benchmark of the MERF inference pipeline')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help='benchmark every stage over a grid of sizes and batch sizes')
+    run_parser.add_argument('--sizes', type=str, default='256x384', help='comma separated HxW, multiples of 32')
+    run_parser.add_argument('--batch_sizes', type=str, default='1', help='comma separated batch sizes')
+    run_parser.add_argument('--warmup', type=int, default=1, help='untimed runs of each stage')
+    run_parser.add_argument('--repeat', type=int, default=5, help='timed runs of each stage')
+    run_parser.add_argument('--percentiles', type=str, default='10,90', help='percentiles reported besides the median')
+    run_parser.add_argument('--device', type=str, default='cpu', help='device to run on')
+    run_parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads, 0 for the default')
+    run_parser.add_argument('--corr_chunk_size', type=int, default=0, help='as in the test options')
+    run_parser.add_argument('--seed', type=int, default=0, help='seed of the random weights')
+    run_parser.add_argument('--output', type=str, default='', help='write the results to this JSON file')
+
+    compare_parser = subparsers.add_parser('compare', help='flag regressions of a run against a baseline run')
+    compare_parser.add_argument('baseline', type=str, help='JSON file written by run')
+    compare_parser.add_argument('current', type=str, help='JSON file written by run')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='relative median time increase flagged')
+    compare_parser.add_argument('--memory_threshold', type=float, default=0.2, help='relative peak memory increase flagged')
+    compare_parser.add_argument('--memory_slack', type=float, default=16, help='peak memory increases below this many MB are ignored')
+
+    imports_parser = subparsers.add_parser('imports', help='time the imports of the inference entry point')
+    imports_parser.add_argument('--modules', type=str, default='', help='comma separated modules, defaults to those of test.py')
+    imports_parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters timed')
+    imports_parser.add_argument('--top', type=int, default=10, help='slowest packages listed')
+    imports_parser.add_argument('--output', type=str, default='', help='write the results to this JSON file')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'imports':
+        imports(args)
+    else:
+        sys.exit(1 if compare(args) else 0)
@@ -0,0 +1,43 @@
+"""Packs the five MERF checkpoints of an epoch into one memory-mapped weight bundle.
+
+    python bundle_weights.py --name Final                  # checkpoints/Final/400_net_*.pth -> 400_nets.bundle
+
+SingleModel loads <epoch>_nets.bundle from the checkpoint directory when it exists, or the file
+given with --weights_bundle. 'module.' prefixes of DataParallel checkpoints are removed. The
+bundle is read back and compared with the checkpoints before the script returns.
+"""
+import argparse
+import os
+import time
+import torch
+
+from models.base_model import strip_module_prefix
+from models import weight_bundle
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='pack MERF checkpoints into one weight bundle')
+    parser.add_argument('--checkpoints_dir', type=str, default='./checkpoints', help='models are saved here')
+    parser.add_argument('--name', type=str, required=True, help='name of the experiment, the checkpoint subdirectory')
+    parser.add_argument('--epoch', type=str, default='400', help='epoch label of the checkpoints')
+    parser.add_argument('--labels', type=str, default='G,D,M,A,R', help='comma separated network labels to pack')
+    parser.add_argument('--output', type=str, default='', help='bundle path, defaults to <epoch>_nets.bundle in the checkpoint directory')
+    args = parser.parse_args()
+
+    save_dir = os.path.join(args.checkpoints_dir, args.name)
+    output = args.output or weight_bundle.bundle_path(save_dir, args.epoch)
+    state_dicts = {}
+    for label in args.labels.split(','):
+        path = os.path.join(save_dir, '%s_net_%s.pth' % (args.epoch, label))
+        state_dicts[label] = strip_module_prefix(torch.load(path, map_location='cpu'))
+        print('%s: %d tensors from %s' % (label, len(state_dicts[label]), path))
+    weight_bundle.save_bundle(state_dicts, output)
+
+    start = time.time()
+    loaded = weight_bundle.load_bundle(output)
+    load_time = time.time() - start
+    for label, state_dict in state_dicts.items():
+        assert list(loaded[label].keys()) == list(state_dict.keys()), 'keys of %s differ' % label
+        for key, tensor in state_dict.items():
+            assert torch.equal(loaded[label][key], tensor), '%s.%s differs' % (label, key)
+    print('bundle written to %s (%.1f MB), verified and loaded in %.3fs'
+          % (output, os.path.getsize(output) / 1024. / 1024., load_time))
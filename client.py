@@ -0,0 +1,83 @@
+"""Sends exposure pairs to server.py and saves the fused images.
+
+    python client.py under.png over.png fused.png                     # one pair
+    python client.py --dataroot test_data --output_dir fused --concurrency 4
+    python client.py --health
+
+With --dataroot, the pairs of low/ and high/ are sent from --concurrency threads at once, so that
+the server can batch them, and the latency of every request is reported.
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+
+
+def multipart(files):
+    # a multipart/form-data body with the given {field: (filename, bytes)} and its content type
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, (filename, data) in files.items():
+        parts.append(('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                      'Content-Type: application/octet-stream\r\n\r\n' % (boundary, name, filename)).encode('utf-8'))
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(('--%s--\r\n' % boundary).encode('utf-8'))
+    return b''.join(parts), 'multipart/form-data; boundary=%s' % boundary
+
+
+def fuse(url, path_A, path_B, output_path, image_format='', timeout=600):
+    # posts one pair and writes the fused image, returns the request latency in seconds
+    with open(path_A, 'rb') as f_A, open(path_B, 'rb') as f_B:
+        body, content_type = multipart({'A': (os.path.basename(path_A), f_A.read()),
+                                        'B': (os.path.basename(path_B), f_B.read())})
+    query = '?format=%s' % image_format if image_format else ''
+    request = Request(url.rstrip('/') + '/fuse' + query, data=body, headers={'Content-Type': content_type})
+    start = time.time()
+    with urlopen(request, timeout=timeout) as response:
+        data = response.read()
+    latency = time.time() - start
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return latency
+
+
+def get(url, path):
+    with urlopen(url.rstrip('/') + path) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='client of the MERF inference server')
+    parser.add_argument('paths', nargs='*', help='under-exposed image, over-exposed image, output path')
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='address of server.py')
+    parser.add_argument('--dataroot', type=str, default='', help='send every pair of dataroot/low and dataroot/high')
+    parser.add_argument('--output_dir', type=str, default='./fused', help='fused images of --dataroot are written here')
+    parser.add_argument('--format', type=str, default='', help='image format of the answer, defaults to the server --output_format')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight with --dataroot')
+    parser.add_argument('--health', action='store_true', help='print /health and /queue and exit')
+    args = parser.parse_args()
+
+    if args.health:
+        print(json.dumps({'health': get(args.url, '/health'), 'queue': get(args.url, '/queue')}, indent=1))
+    elif args.dataroot:
+        names = sorted(os.listdir(os.path.join(args.dataroot, 'low')))
+        if not os.path.exists(args.output_dir):
+            os.makedirs(args.output_dir)
+        jobs = [(os.path.join(args.dataroot, 'low', name), os.path.join(args.dataroot, 'high', name),
+                 os.path.join(args.output_dir, os.path.splitext(name)[0] + '.' + (args.format or 'png')))
+                for name in names]
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            latencies = list(executor.map(lambda job: fuse(args.url, job[0], job[1], job[2], args.format), jobs))
+        for job, latency in zip(jobs, latencies):
+            print('%s: %.2fs' % (job[2], latency))
+        print('%d pairs in %.2fs' % (len(jobs), time.time() - start))
+        print(json.dumps(get(args.url, '/queue')))
+    elif len(args.paths) == 3:
+        print('%s: %.2fs' % (args.paths[2], fuse(args.url, args.paths[0], args.paths[1], args.paths[2], args.format)))
+    else:
+        parser.error('give an under-exposed image, an over-exposed image and an output path, or --dataroot')
@@ -1,7 +1,8 @@
 import torch.utils.data as data
 from PIL import Image
-import torchvision.transforms as transforms
+import numpy as np
 import random
+import torch
 
 
 class BaseDataset(data.Dataset):
@@ -15,7 +16,14 @@ class BaseDataset(data.Dataset):
         pass
 
 
+def to_tensor(img):
+    # transforms.ToTensor() for 8-bit PIL images without importing torchvision: [C, H, W] in [0, 1]
+    img = torch.from_numpy(np.array(img, np.uint8, copy=True))
+    return img.view(img.size(0), img.size(1), -1).permute(2, 0, 1).contiguous().float().div(255)
+
+
 def get_transform(opt):
+    import torchvision.transforms as transforms
     transform_list = []
     if opt.resize_or_crop == 'resize_and_crop':
         zoom = 1 + 0.1 * random.randint(0, 4)
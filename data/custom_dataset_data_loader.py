@@ -1,5 +1,6 @@
 import torch.utils.data
 from data.base_data_loader import BaseDataLoader
+from data.prefetch_loader import PrefetchLoader
 
 
 def CreateDataset(opt):
@@ -28,14 +29,29 @@ class CustomDatasetDataLoader(BaseDataLoader):
         BaseDataLoader.initialize(self, opt)
         # 读入data的地址目录了
         self.dataset = CreateDataset(opt)
-        self.dataloader = torch.utils.data.DataLoader(
-            self.dataset,
-            batch_size=opt.batchSize,
-            shuffle=not opt.serial_batches,
-            num_workers=int(opt.nThreads))
+        loader_args = {'num_workers': int(opt.nThreads)}
+        # page-locked batches let the host to device copies run asynchronously
+        device = getattr(opt, 'device', None)
+        loader_args['pin_memory'] = device is not None and device.type == 'cuda'
+        if opt.nThreads > 0 and opt.prefetch > 0:
+            # every worker process decodes up to prefetch batches ahead, sent back in shared memory
+            loader_args['prefetch_factor'] = opt.prefetch
+        if hasattr(self.dataset, 'get_batch_sampler'):
+            # pairs of the same size are bucketed so that they can be stacked into one batch,
+            # test.py restricts the loader to the pair_indices of a worker or left by --resume
+            self.dataloader = torch.utils.data.DataLoader(
+                self.dataset,
+                batch_sampler=self.dataset.get_batch_sampler(opt.batchSize, getattr(opt, 'pair_indices', None)),
+                **loader_args)
+        else:
+            self.dataloader = torch.utils.data.DataLoader(
+                self.dataset,
+                batch_size=opt.batchSize,
+                shuffle=not opt.serial_batches,
+                **loader_args)
 
     def load_data(self):
-        return self.dataloader
+        return PrefetchLoader(self.dataloader, self.opt.prefetch)
 
     def __len__(self):
         return min(len(self.dataset), self.opt.max_dataset_size)
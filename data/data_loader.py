@@ -1,3 +1,5 @@
+import copy
+
 
 def CreateDataLoader(opt):
     from data.custom_dataset_data_loader import CustomDatasetDataLoader
@@ -6,3 +8,11 @@ def CreateDataLoader(opt):
     # 读入图片，生成data loader
     data_loader.initialize(opt)
     return data_loader
+
+
+def CreateCalibrationLoader(opt):
+    # pairs used to calibrate static quantization, taken in order from calibration_dataroot or dataroot
+    opt = copy.copy(opt)
+    opt.dataroot = opt.calibration_dataroot or opt.dataroot
+    opt.serial_batches = True
+    return CreateDataLoader(opt).load_data()
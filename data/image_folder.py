@@ -14,22 +14,27 @@ import os.path
 IMG_EXTENSIONS = [
     '.jpg', '.JPG', '.jpeg', '.JPEG',
     '.png', '.PNG', '.ppm', '.PPM', '.bmp', '.BMP',
+    '.tif', '.TIF', '.tiff', '.TIFF', '.webp', '.WEBP',
 ]
 
 
+IMG_SUFFIXES = tuple(IMG_EXTENSIONS)
+
+
 def is_image_file(filename):
-    return any(filename.endswith(extension) for extension in IMG_EXTENSIONS)
+    return filename.endswith(IMG_SUFFIXES)
 
 
-def make_dataset(dir):
+def make_dataset(dir, images_only=True):
+    # images_only=False also lists the other files, such as the .npy flows of the training set
     images = []
     assert os.path.isdir(dir), '%s is not a valid directory' % dir
 
     for root, _, fnames in sorted(os.walk(dir)):
         for fname in fnames:
-            # if is_image_file(fname):
-            path = os.path.join(root, fname)
-            images.append(path)
+            if not images_only or is_image_file(fname):
+                path = os.path.join(root, fname)
+                images.append(path)
 
     return images
 
@@ -7,11 +7,7 @@ from PIL import Image
 import PIL
 import random
 import torch
-from pdb import set_trace as st
 import numpy as np
-import cv2
-import time
-import scipy
 
 
 class PairDataset(BaseDataset):
@@ -29,7 +25,7 @@ class PairDataset(BaseDataset):
         self.B2_paths = make_dataset(self.dir_B2)
         # self.E_paths = make_dataset(self.dir_E)
         self.C_paths = make_dataset(self.dir_C)
-        self.flow_paths = make_dataset(self.dir_flow)
+        self.flow_paths = make_dataset(self.dir_flow, images_only=False)
 
         self.A_paths = sorted(self.A_paths)
         self.B_paths = sorted(self.B_paths)
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+from PIL import Image
+from data.image_folder import IMG_EXTENSIONS, is_image_file
+
+# bump when the layout of the cache file changes
+INDEX_VERSION = 2
+
+
+def scan_images(root):
+    """Image files under root by stem, the path relative to root without extension.
+
+    Directories are listed with os.scandir, whose entries carry their type, so no file is stat'ed.
+    Returns (images, skipped, duplicates, dirs): skipped are the files that are not images,
+    duplicates the images whose stem is already taken (sub/1.jpg next to sub/1.png, the first in
+    sorted order is kept) and dirs the modification time of every directory, which changes
+    whenever an entry is added, removed or renamed in it.
+    """
+    images, skipped, duplicates, dirs = {}, [], [], {}
+    pending = ['']
+    while pending:
+        rel_dir = pending.pop()
+        path = os.path.join(root, rel_dir)
+        dirs[rel_dir] = os.stat(path).st_mtime_ns
+        # plain string operations, os.path.join and splitext dominate the time on large directories
+        prefix = rel_dir + os.sep if rel_dir else ''
+        with os.scandir(path) as entries:
+            for entry in entries:
+                rel = prefix + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(rel)
+                elif entry.is_dir():
+                    # symlinked directories are not followed, as by os.walk, a link cycle would never end
+                    continue
+                elif not is_image_file(entry.name):
+                    skipped.append(rel)
+                else:
+                    stem = rel.rpartition('.')[0]
+                    if stem not in images:
+                        images[stem] = rel
+                    else:
+                        duplicates.append(max(rel, images[stem]))
+                        images[stem] = min(rel, images[stem])
+    return images, sorted(skipped), sorted(duplicates), dirs
+
+
+def default_cache_path(dataroot):
+    # dataroot/.pair_index.json, or a file of the user cache directory when dataroot is read-only
+    if os.access(dataroot, os.W_OK):
+        return os.path.join(dataroot, '.pair_index.json')
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')),
+                             'merf')
+    os.makedirs(cache_dir, exist_ok=True)
+    name = hashlib.sha1(os.path.abspath(dataroot).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, 'pair_index_%s.json' % name)
+
+
+def dirs_unchanged(root, dirs):
+    for rel_dir, mtime in dirs.items():
+        try:
+            if os.stat(os.path.join(root, rel_dir)).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+class PairIndex():
+    """Exposure pairs of dir_A and dir_B matched by file stem rather than by sorted position.
+
+    pairs lists the (stem, path_A, path_B) of the stems found on both sides, sorted by stem.
+    unpaired_A and unpaired_B hold the image files with no counterpart, skipped the files that
+    are not images and duplicates the images whose stem appears twice on one side. With a
+    cache_path, the index is saved there as JSON and reused for as long as the modification
+    times of all directories of both trees are unchanged. The image sizes read by image_sizes()
+    are saved with it.
+    """
+
+    def __init__(self, dir_A, dir_B, cache_path=''):
+        self.dir_A = dir_A
+        self.dir_B = dir_B
+        self.cache_path = cache_path
+        self.from_cache = False
+        cached = self.load(cache_path) if cache_path else None
+        if cached is not None and self.is_current(cached):
+            index = cached
+            self.from_cache = True
+        else:
+            index = self.build()
+            if cached is not None:
+                # sizes outlive a rebuild, image_sizes() checks them against the file mtimes
+                kept = set(rel_A for _, rel_A, _ in index['pairs'])
+                index['sizes'] = dict((rel, size) for rel, size in cached.get('sizes', {}).items() if rel in kept)
+            if cache_path:
+                self.save(index, cache_path)
+        self.index = index
+        prefix_A, prefix_B = os.path.join(dir_A, ''), os.path.join(dir_B, '')
+        self.pairs = [(stem, prefix_A + rel_A, prefix_B + rel_B) for stem, rel_A, rel_B in index['pairs']]
+        self.unpaired_A = [prefix_A + rel for rel in index['unpaired_A']]
+        self.unpaired_B = [prefix_B + rel for rel in index['unpaired_B']]
+        self.skipped = [prefix_A + rel for rel in index['skipped_A']] + [prefix_B + rel for rel in index['skipped_B']]
+        self.duplicates = [prefix_A + rel for rel in index['duplicates_A']] + \
+            [prefix_B + rel for rel in index['duplicates_B']]
+
+    def build(self):
+        assert os.path.isdir(self.dir_A), '%s is not a valid directory' % self.dir_A
+        assert os.path.isdir(self.dir_B), '%s is not a valid directory' % self.dir_B
+        images_A, skipped_A, duplicates_A, dirs_A = scan_images(self.dir_A)
+        images_B, skipped_B, duplicates_B, dirs_B = scan_images(self.dir_B)
+        return {'version': INDEX_VERSION, 'extensions': IMG_EXTENSIONS,
+                'dir_A': os.path.abspath(self.dir_A), 'dir_B': os.path.abspath(self.dir_B),
+                'dirs_A': dirs_A, 'dirs_B': dirs_B,
+                'pairs': [(stem, images_A[stem], images_B[stem]) for stem in sorted(images_A) if stem in images_B],
+                'unpaired_A': sorted(images_A[stem] for stem in images_A if stem not in images_B),
+                'unpaired_B': sorted(images_B[stem] for stem in images_B if stem not in images_A),
+                'skipped_A': skipped_A, 'skipped_B': skipped_B,
+                'duplicates_A': duplicates_A, 'duplicates_B': duplicates_B, 'sizes': {}}
+
+    def load(self, cache_path):
+        # the cached index of these directories, or None when it is missing or unreadable
+        try:
+            with open(cache_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index.get('version') != INDEX_VERSION or index.get('extensions') != IMG_EXTENSIONS or \
+                index.get('dir_A') != os.path.abspath(self.dir_A) or index.get('dir_B') != os.path.abspath(self.dir_B):
+            return None
+        return index
+
+    def is_current(self, index):
+        return dirs_unchanged(self.dir_A, index['dirs_A']) and dirs_unchanged(self.dir_B, index['dirs_B'])
+
+    def image_sizes(self, indices):
+        """(W, H) of the under-exposed image of the given pairs.
+
+        A size is read from the image header once and kept in the index with the mtime of the
+        file, later calls only stat the file. New sizes are saved to the cache.
+        """
+        sizes = self.index['sizes']
+        result = []
+        changed = False
+        for i in indices:
+            _, path_A, _ = self.pairs[i]
+            rel_A = self.index['pairs'][i][1]
+            mtime = os.stat(path_A).st_mtime_ns
+            size = sizes.get(rel_A)
+            if size is None or size[2] != mtime:
+                W, H = Image.open(path_A).size
+                size = sizes[rel_A] = [W, H, mtime]
+                changed = True
+            result.append((size[0], size[1]))
+        if changed and self.cache_path:
+            self.save(self.index, self.cache_path)
+        return result
+
+    def save(self, index, cache_path):
+        # a read-only dataroot only costs the cache
+        tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print('pair index not cached: %s' % e)
+
+    def report(self, limit=10):
+        # prints the files left out of the pairs, at most limit names of each kind
+        print('pair index: %d pairs%s' % (len(self.pairs), ' (cached)' if self.from_cache else ''))
+        for label, paths in (('unpaired', self.unpaired_A + self.unpaired_B), ('duplicate stem', self.duplicates),
+                             ('not an image', self.skipped)):
+            if paths:
+                print('  %d %s: %s%s' % (len(paths), label, ', '.join(paths[:limit]),
+                                         ', ...' if len(paths) > limit else ''))
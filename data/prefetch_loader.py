@@ -0,0 +1,74 @@
+import threading
+import time
+from queue import Queue, Full
+
+
+class PrefetchLoader():
+    """Iterates a DataLoader on a background thread, keeping up to depth batches ready.
+
+    Image decoding and resizing in PIL release the GIL, so the next pairs are prepared while
+    the current one is inferring. Batches come out in the order of the wrapped loader.
+    wait_time is the time the consumer spent blocked on input, load_time the time the
+    background thread spent producing it.
+    """
+
+    def __init__(self, loader, depth=2):
+        self.loader = loader
+        self.depth = depth
+        self.wait_time = 0.0
+        self.load_time = 0.0
+        self.count = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _put(self, queue, item, stop):
+        # blocks until there is room for item, or until the consumer stops reading
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def _produce(self, queue, stop):
+        try:
+            iterator = iter(self.loader)
+            while not stop.is_set():
+                start = time.time()
+                try:
+                    item = (next(iterator), None)
+                except StopIteration:
+                    item = (None, None)
+                self.load_time += time.time() - start
+                self._put(queue, item, stop)
+                if item[0] is None:
+                    return
+        except Exception as e:
+            self._put(queue, (None, e), stop)
+
+    def __iter__(self):
+        if self.depth <= 0:
+            for batch in self.loader:
+                yield batch
+            return
+
+        queue = Queue(maxsize=self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(queue, stop))
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                start = time.time()
+                batch, error = queue.get()
+                self.wait_time += time.time() - start
+                if error is not None:
+                    raise error
+                if batch is None:
+                    return
+                self.count += 1
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
@@ -1,10 +1,29 @@
 import os.path
-import torchvision.transforms as transforms
-from data.base_dataset import BaseDataset
-from data.image_folder import make_dataset
+from collections import OrderedDict
+import torch.utils.data as data
+from data.base_dataset import BaseDataset, to_tensor
+from data.pair_index import PairIndex, default_cache_path
 from PIL import Image
 
 
+class SizeBucketBatchSampler(data.Sampler):
+    """Groups dataset indices whose (rounded-to-32) sizes match into batches."""
+
+    def __init__(self, sizes, batch_size, indices=None):
+        self.batch_size = batch_size
+        self.buckets = OrderedDict()
+        for index, size in zip(indices if indices is not None else range(len(sizes)), sizes):
+            self.buckets.setdefault(size, []).append(index)
+
+    def __iter__(self):
+        for indices in self.buckets.values():
+            for i in range(0, len(indices), self.batch_size):
+                yield indices[i:i + self.batch_size]
+
+    def __len__(self):
+        return sum((len(indices) + self.batch_size - 1) // self.batch_size for indices in self.buckets.values())
+
+
 class PairDataset(BaseDataset):
     def initialize(self, opt):
         self.opt = opt
@@ -12,22 +31,30 @@ class PairDataset(BaseDataset):
         self.dir_A = os.path.join(opt.dataroot, 'low')
         self.dir_B = os.path.join(opt.dataroot, 'high')
 
-        self.A_paths = make_dataset(self.dir_A)
-        self.B_paths = make_dataset(self.dir_B)
-
-        self.A_paths = sorted(self.A_paths)
-        self.B_paths = sorted(self.B_paths)
+        # low/x.png pairs with high/x.jpg, a file missing on one side is reported instead of shifting every pair
+        cache_path = '' if getattr(opt, 'no_index_cache', False) else \
+            getattr(opt, 'index_cache', '') or default_cache_path(opt.dataroot)
+        self.index = PairIndex(self.dir_A, self.dir_B, cache_path)
+        self.index.report()
+        self.A_paths = [path_A for _, path_A, _ in self.index.pairs]
+        self.B_paths = [path_B for _, _, path_B in self.index.pairs]
 
         self.A_size = len(self.A_paths)
         self.B_size = len(self.B_paths)
 
+        # 将PIL Image由HWC转置为CHW格式，再转为float后每个像素除以255
+        self.transform = to_tensor
 
-        transform_list = []
-
-        transform_list += [transforms.ToTensor()]
-        # 函数接受PIL Image或numpy.ndarray，将其先由HWC转置为CHW格式，再转为float后每个像素除以255
-        # transform_list = [transforms.ToTensor()]
-        self.transform = transforms.Compose(transform_list)
+    def get_batch_sampler(self, batch_size, indices=None):
+        # batches of the given dataset indices, all of them by default
+        indices = range(len(self)) if indices is None else indices
+        if batch_size == 1 or getattr(self.opt, 'sequence', False):
+            # nothing to stack, or the frames of a sequence: the pairs keep their order and no
+            # image header is read
+            return data.BatchSampler(indices, batch_size, False)
+        # pairs are resized to a multiple of 32 in __getitem__
+        sizes = [(W - W % 32, H - H % 32) for W, H in self.index.image_sizes(indices)]
+        return SizeBucketBatchSampler(sizes, batch_size, indices)
 
     def __getitem__(self, index):
         A_path = self.A_paths[index % self.A_size]
@@ -42,11 +69,10 @@ class PairDataset(BaseDataset):
         A_img = self.transform(A_img)
         B_img = self.transform(B_img)
 
-        return {'A': A_img, 'B': B_img, 'A_paths': A_path, 'B_paths': B_path}
+        return {'A': A_img, 'B': B_img, 'A_paths': A_path, 'B_paths': B_path, 'index': index}
 
     def __len__(self):
         return self.A_size
 
     def name(self):
         return 'PairDataset'
-
@@ -0,0 +1,64 @@
+"""Exports the five MERF networks as one module that loads without the MERF sources.
+
+    python export.py --name Final                      # torch.export, any HxW multiple of 32
+    python export.py --name Final --export_format torchscript --export_size 608x416
+
+The exported module takes the under- and over-exposed images [B, 3, H, W] in [0, 1] and returns
+the fused image before clamping (SingleModel.refinement). The file is loaded again in a separate
+Python process without the MERF sources and its output is checked against the eager networks,
+at --export_size and, for torch.export, at a second size.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import torch
+
+from options.test_options import TestOptions
+from models.models import create_model
+from models.pipeline import export_program, export_torchscript
+
+VERIFY = '''
+import sys, time, torch
+path, data = sys.argv[1], torch.load(sys.argv[2])
+module = torch.export.load(path).module() if path.endswith('.pt2') else torch.jit.load(path)
+with torch.no_grad():
+    for input_A, input_B, expected in data:
+        start = time.time()
+        output = module(input_A, input_B)
+        print('%dx%d: max abs difference %.3g, %.2fs' % (input_A.size(2), input_A.size(3),
+              (output - expected).abs().max().item(), time.time() - start))
+'''
+
+if __name__ == '__main__':
+    opt = TestOptions().parse()
+    height, width = [int(size) for size in opt.export_size.split('x')]
+    assert height % 32 == 0 and width % 32 == 0, '--export_size should be a multiple of 32'
+    extension = '.pt2' if opt.export_format == 'export' else '.pt'
+    path = opt.export_path or os.path.join(opt.checkpoints_dir, opt.name, 'merf' + extension)
+
+    model = create_model(opt)
+    pipeline = model.pipeline()
+    example_inputs = (torch.rand(1, 3, height, width), torch.rand(1, 3, height, width))
+
+    if opt.export_format == 'export':
+        export_program(pipeline, example_inputs, path)
+        sizes = [(height, width), (height + 32, width + 64)]
+    elif opt.export_format == 'torchscript':
+        export_torchscript(pipeline, example_inputs, path)
+        sizes = [(height, width)]
+    else:
+        raise ValueError('export format [%s] is not recognized' % opt.export_format)
+    print('pipeline exported to %s' % path)
+
+    checks = []
+    with torch.no_grad():
+        for h, w in sizes:
+            input_A, input_B = torch.rand(1, 3, h, w), torch.rand(1, 3, h, w)
+            checks.append((input_A, input_B, pipeline(input_A, input_B)))
+
+    # a fresh, isolated interpreter in an empty directory cannot import the MERF sources
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = os.path.join(tmp_dir, 'checks.pt')
+        torch.save(checks, data_path)
+        subprocess.check_call([sys.executable, '-I', '-c', VERIFY, os.path.abspath(path), data_path], cwd=tmp_dir)
@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 from torch.nn import init
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 
 def init_weights(net, init_type='normal', gain=0.02):
@@ -27,6 +28,16 @@ def init_weights(net, init_type='normal', gain=0.02):
     net.apply(init_func)
 
 
+def fuse_conv_bn(sequential):
+    # folds every BatchNorm2d of sequential into the Conv2d before it, in place; eval mode only.
+    # The BatchNorm becomes an Identity so that the indices, and the state dict keys, of the
+    # remaining layers do not change.
+    for i in range(1, len(sequential)):
+        if isinstance(sequential[i], nn.BatchNorm2d) and isinstance(sequential[i - 1], nn.Conv2d):
+            sequential[i - 1] = fuse_conv_bn_eval(sequential[i - 1], sequential[i])
+            sequential[i] = nn.Identity()
+
+
 class conv_block(nn.Module):
     def __init__(self, ch_in, ch_out):
         super(conv_block, self).__init__()
@@ -117,6 +128,20 @@ class AttU_Net(nn.Module):
         self.Conv_1x1 = nn.Conv2d(64, output_ch, kernel_size=1, stride=1, padding=0)
         init_weights(self, init_type='normal', gain=0.02)
 
+    def fuse_for_inference(self):
+        """Folds every BatchNorm into the preceding convolution, for inference only.
+
+        In eval mode BatchNorm is a per-channel affine map, so the outputs do not change beyond
+        rounding, but each block reads and writes its full resolution activations once less.
+        The running statistics are gone afterwards: load checkpoints before calling this and do
+        not train the fused network.
+        """
+        assert not self.training, 'BatchNorm folding uses the running statistics, call eval() first'
+        for module in self.modules():
+            if isinstance(module, nn.Sequential):
+                fuse_conv_bn(module)
+        return self
+
     def forward(self, x_o, x_u, lf):
         # encoding path
         # x_ref = self.conv_fuse(torch.cat([x_lf, x_u], dim=1))
@@ -1,5 +1,20 @@
 import os
+from collections import OrderedDict
 import torch
+from . import weight_bundle
+
+
+def strip_module_prefix(state_dict):
+    # checkpoints saved from a DataParallel wrapper prefix every key with 'module.', the version
+    # metadata is kept as quantized modules need it to read their packed parameters
+    def strip(key):
+        return '' if key == 'module' else key[len('module.'):] if key.startswith('module.') else key
+
+    stripped = OrderedDict((strip(k), v) for k, v in state_dict.items())
+    metadata = getattr(state_dict, '_metadata', None)
+    if metadata is not None:
+        stripped._metadata = OrderedDict((strip(k), v) for k, v in metadata.items())
+    return stripped
 
 
 class BaseModel():
@@ -9,9 +24,12 @@ class BaseModel():
     def initialize(self, opt):
         self.opt = opt
         self.gpu_ids = opt.gpu_ids
+        self.device = getattr(opt, 'device', torch.device('cpu'))
         self.isTrain = opt.isTrain
-        self.Tensor = torch.cuda.FloatTensor if self.gpu_ids else torch.Tensor
+        self.Tensor = torch.cuda.FloatTensor if self.device.type == 'cuda' else torch.Tensor
         self.save_dir = os.path.join(opt.checkpoints_dir, opt.name)
+        if self.device.type == 'cuda':
+            torch.backends.cudnn.benchmark = True
 
     def set_input(self, input):
         self.input = input
@@ -42,25 +60,48 @@ class BaseModel():
     def save_network(self, network, network_label, epoch_label, gpu_ids):
         save_filename = '%s_net_%s.pth' % (epoch_label, network_label)
         save_path = os.path.join(self.save_dir, save_filename)
+        if isinstance(network, torch.nn.DataParallel):
+            network = network.module
         torch.save(network.cpu().state_dict(), save_path)
-        if len(gpu_ids) and torch.cuda.is_available():
-            network.cuda(device=gpu_ids[0])
+        network.to(self.device)
 
     # helper loading function that can be used by subclasses
     def load_network(self, network, network_label, epoch_label):
         save_filename = '%s_net_%s.pth' % (epoch_label, network_label)
         save_path = os.path.join(self.save_dir, save_filename)
-        # solution 1
-        # network = torch.nn.DataParallel(network)
-        torch.backends.cudnn.benchmark = True
-        network.load_state_dict(torch.load(save_path))
+        # checkpoints load the same with or without a DataParallel wrapper on either side
+        if isinstance(network, torch.nn.DataParallel):
+            network = network.module
+        state_dict = torch.load(save_path, map_location=self.device)
+        network.load_state_dict(strip_module_prefix(state_dict))
+
+    def load_networks(self, networks, epoch_label):
+        """Loads (network, label) pairs from the weight bundle of epoch_label, or one by one.
+
+        The bundle is --weights_bundle, or <epoch>_nets.bundle in the checkpoint directory when it
+        exists, see bundle_weights.py. On CPU the parameters become views of the memory-mapped
+        bundle instead of copies. Without a bundle, every network loads from its own .pth file.
+        """
+        path = getattr(self.opt, 'weights_bundle', '')
+        if not path:
+            path = weight_bundle.bundle_path(self.save_dir, epoch_label)
+            if not os.path.exists(path):
+                for network, label in networks:
+                    self.load_network(network, label, epoch_label)
+                return
+        state_dicts = weight_bundle.load_bundle(path)
+        for network, label in networks:
+            if isinstance(network, torch.nn.DataParallel):
+                network = network.module
+            network.load_state_dict(state_dicts[label], assign=self.device.type == 'cpu')
+        print('networks %s loaded from %s' % (', '.join(label for _, label in networks), path))
 
     def load_network2(self, network, network_label, epoch_label):
         save_filename = '%s_net_%s.pth' % (epoch_label, network_label)
         save_path = os.path.join(self.save_dir, save_filename)
         # solution 1
 
-        network.load_state_dict(torch.load(save_path))
+        network.load_state_dict(torch.load(save_path, map_location=self.device))
 
     def update_learning_rate():
         pass
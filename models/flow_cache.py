@@ -0,0 +1,122 @@
+import hashlib
+import os
+import numpy as np
+import torch
+
+
+def update_hash(h, value):
+    # quantized networks hold quantized tensors, tuples of packed parameters and dtypes in their state dicts
+    if torch.is_tensor(value):
+        if value.is_quantized:
+            value = value.dequantize()
+        h.update(np.ascontiguousarray(value.detach().cpu().float().numpy()).data)
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            update_hash(h, item)
+    else:
+        h.update(repr(value).encode())
+
+
+def state_hash(*networks):
+    # identity of the weights that produce a flow, independent of how they were loaded
+    h = hashlib.sha1()
+    for network in networks:
+        for name, value in sorted(network.state_dict().items()):
+            h.update(name.encode())
+            update_hash(h, value)
+    return h.hexdigest()
+
+
+class FlowCache():
+    """On-disk cache of estimated flows, keyed by the content of an exposure pair.
+
+    Every entry is one uncompressed float16 .npy file of shape [2, H, W], read whole and
+    widened to float32. Reads refresh the file mtime. The size of the directory is tracked in
+    memory from the entries written by this process; once it goes past max_bytes it is scanned
+    and the least recently used entries are removed down to LOW_WATER of max_bytes, so a scan
+    happens once every several writes rather than on each. Writes go through a temporary file
+    and a rename, so concurrent processes sharing the directory never see partial entries.
+    """
+
+    LOW_WATER = 0.9
+
+    def __init__(self, cache_dir, max_bytes, checkpoint_id):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.checkpoint_id = checkpoint_id
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # size of the directory, None until the first write scans it
+        self.total = None
+
+    def key(self, input_A, input_B, tag=''):
+        h = hashlib.sha1()
+        h.update(self.checkpoint_id.encode())
+        h.update(tag.encode())
+        for tensor in (input_A, input_B):
+            array = np.ascontiguousarray(tensor.detach().cpu().numpy())
+            h.update(str((array.shape, array.dtype.str)).encode())
+            h.update(array.data)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            flow = np.load(path)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return torch.from_numpy(flow.astype(np.float32))
+
+    def put(self, key, flow):
+        path = self.path(key)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, flow.detach().cpu().numpy().astype(np.float16))
+            size = f.tell()
+        if self.total is None:
+            self.total = self.scan_size()
+        try:
+            # an entry written by another process in the meantime is replaced
+            self.total -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(tmp_path, path)
+        self.total += size
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def scan_size(self):
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npy'):
+                try:
+                    total += entry.stat().st_size
+                except OSError:
+                    pass
+        return total
+
+    def evict(self):
+        # removes the least recently used entries until the directory is under LOW_WATER of max_bytes
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * self.LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.total = total
@@ -1,40 +1,100 @@
+import threading
+from collections import OrderedDict
 import torch
 import torch.nn.functional as F
 
+# grids only depend on their shape, dtype and device, so they are built once and shared.
+# tensors handed out from the cache must never be modified in place.
+GRID_CACHE_SIZE = 32
+_grid_cache = OrderedDict()
+_grid_cache_lock = threading.Lock()
+
+
+def is_tracing():
+    # graphs captured by torch.jit.trace, torch.export or torch.compile must build their grids
+    # from symbolic sizes instead of baking cached tensors of the example size in as constants
+    compiler = getattr(torch, 'compiler', None)
+    return torch.jit.is_tracing() or (compiler is not None and compiler.is_compiling())
+
+
+def cached_grid(key, build):
+    if is_tracing():
+        return build()
+    with _grid_cache_lock:
+        grid = _grid_cache.get(key)
+        if grid is not None:
+            _grid_cache.move_to_end(key)
+            return grid
+    grid = build()
+    with _grid_cache_lock:
+        _grid_cache[key] = grid
+        while len(_grid_cache) > GRID_CACHE_SIZE:
+            _grid_cache.popitem(last=False)
+    return grid
 
-def coords_grid(b, h, w, homogeneous=False, device=None):
-    y, x = torch.meshgrid(torch.arange(h), torch.arange(w))  # [H, W]
 
-    stacks = [x, y]
+def clear_grid_cache():
+    with _grid_cache_lock:
+        _grid_cache.clear()
 
-    if homogeneous:
-        ones = torch.ones_like(x)  # [H, W]
-        stacks.append(ones)
 
-    grid = torch.stack(stacks, dim=0).float()  # [2, H, W] or [3, H, W]
+def _get_device(device):
+    return torch.device(device) if device is not None else torch.device('cpu')
 
-    grid = grid[None].repeat(b, 1, 1, 1)  # [B, 2, H, W] or [B, 3, H, W]
 
-    if device is not None:
-        grid = grid.to(device)
+def coords_grid(b, h, w, homogeneous=False, device=None, dtype=torch.float32):
+    device = _get_device(device)
 
-    return grid
+    def build():
+        y, x = torch.meshgrid(torch.arange(h, dtype=dtype, device=device),
+                              torch.arange(w, dtype=dtype, device=device))  # [H, W]
+
+        stacks = [x, y]
+
+        if homogeneous:
+            ones = torch.ones_like(x)  # [H, W]
+            stacks.append(ones)
+
+        return torch.stack(stacks, dim=0)[None]  # [1, 2, H, W] or [1, 3, H, W]
+
+    grid = cached_grid(('coords', h, w, homogeneous, dtype, device), build)
+
+    return grid.expand(b, -1, -1, -1)  # [B, 2, H, W] or [B, 3, H, W]
+
+
+def pixel_grid(h, w, normalized=False, device=None, dtype=torch.float32):
+    device = _get_device(device)
+
+    def build():
+        if normalized:
+            ys = torch.linspace(-1, 1, h, dtype=dtype, device=device)
+            xs = torch.linspace(-1, 1, w, dtype=dtype, device=device)
+        else:
+            ys = torch.arange(h, dtype=dtype, device=device)
+            xs = torch.arange(w, dtype=dtype, device=device)
+        grid_y, grid_x = torch.meshgrid(ys, xs)
+        return torch.stack((grid_x, grid_y), 2)[None]  # [1, H, W, 2], W(x), H(y)
+
+    return cached_grid(('pixel', h, w, normalized, dtype, device), build)
 
 
 def generate_window_grid(h_min, h_max, w_min, w_max, len_h, len_w, device=None):
     assert device is not None
+    device = _get_device(device)
 
-    x, y = torch.meshgrid([torch.linspace(w_min, w_max, len_w, device=device),
-                           torch.linspace(h_min, h_max, len_h, device=device)],
-                          )
-    grid = torch.stack((x, y), -1).transpose(0, 1).float()  # [H, W, 2]
+    def build():
+        x, y = torch.meshgrid([torch.linspace(w_min, w_max, len_w, device=device),
+                               torch.linspace(h_min, h_max, len_h, device=device)],
+                              )
+        return torch.stack((x, y), -1).transpose(0, 1).float()  # [H, W, 2]
 
-    return grid
+    return cached_grid(('window', h_min, h_max, w_min, w_max, len_h, len_w, device), build)
 
 
 def normalize_coords(coords, h, w):
     # coords: [B, H, W, 2]
-    c = torch.Tensor([(w - 1) / 2., (h - 1) / 2.]).float().to(coords.device)
+    c = cached_grid(('center', h, w, coords.device),
+                    lambda: torch.tensor([(w - 1) / 2., (h - 1) / 2.], device=coords.device))
     return (coords - c) / c  # [-1, 1]
 
 
@@ -66,7 +126,7 @@ def flow_warp(feature, flow, mask=False, padding_mode='zeros'):
     b, c, h, w = feature.size()
     assert flow.size(1) == 2
 
-    grid = coords_grid(b, h, w).to(flow.device) + flow  # [B, 2, H, W]
+    grid = coords_grid(b, h, w, device=flow.device) + flow  # [B, 2, H, W]
 
     return bilinear_sample(feature, grid, padding_mode=padding_mode,
                            return_mask=mask)
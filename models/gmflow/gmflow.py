@@ -6,7 +6,7 @@ from .backbone import CNNEncoder
 from .transformer import FeatureTransformer, FeatureFlowAttention
 from .matching import global_correlation_softmax, local_correlation_softmax
 from .geometry import flow_warp
-from .utils import normalize_img, feature_add_position
+from .utils import normalize_img, feature_add_position, run_in_fp32
 
 
 class ResidualBlockNoBN(nn.Module):
@@ -94,15 +94,20 @@ class GMFlow(nn.Module):
                  num_transformer_layers=6,
                  ffn_dim_expansion=4,
                  num_head=1,
+                 corr_chunk_size=None,
                  **kwargs,
                  ):
         super(GMFlow, self).__init__()
 
+        # process global correlation and global propagation in blocks of this many rows, None for dense
+        self.corr_chunk_size = corr_chunk_size or None
         self.num_scales = num_scales
         self.feature_channels = feature_channels
         self.upsample_factor = upsample_factor
         self.attention_type = attention_type
         self.num_transformer_layers = num_transformer_layers
+        # a StageRecorder timing the correlation, see SingleModel.set_recorder
+        self.recorder = None
 
         # CNN backbone
         self.backbone = CNNEncoder(output_dim=feature_channels, num_output_scales=num_scales)
@@ -141,6 +146,7 @@ class GMFlow(nn.Module):
 
         return feature0, feature1
 
+    @run_in_fp32
     def upsample_flow(self, flow, feature, bilinear=False, upsample_factor=8,
                       ):
         if bilinear:
@@ -166,26 +172,45 @@ class GMFlow(nn.Module):
 
         return up_flow
 
-    def forward(self, img0, img1,
-                attn_splits_list=None,
-                corr_radius_list=None,
-                prop_radius_list=None,
-                pred_bidir_flow=False,
-                init_flow=None,
-                **kwargs,
-                ):
+    def match_scale(self, feature0, feature1, flow, attn_splits, corr_radius, pred_bidir_flow=False):
+        # transformer and matching at one scale, returns the matched flow, the transformed features
+        # and the mean best-match probability of every sample
+        if flow is not None:
+            flow = flow.detach()
+            feature1 = flow_warp(feature1, flow)  # [B, C, H, W]
 
-        results_dict = {}
-        flow_preds = []
-
-        # img0, img1 = normalize_img(img0, img1)  # [B, 3, H, W]
-
-        # resolution low to high， list = [1, 128, 40, 40]
-        feature0_list, feature1_list = self.extract_feature(img0, img1)  # list of features
+        # add position to features
+        feature0, feature1 = feature_add_position(feature0, feature1, attn_splits, self.feature_channels)
 
+        # Transformer
+        feature0, feature1 = self.transformer(feature0, feature1, attn_num_splits=attn_splits)
+        # feature0, feature1 = self.DRDBs(feature0, feature1)
+
+        # correlation and softmax
+        record = self.recorder.begin('flow.correlation', (feature0, feature1)) if self.recorder is not None else None
+        if corr_radius == -1:  # global matching
+            flow_pred, prob = global_correlation_softmax(feature0, feature1, pred_bidir_flow,
+                                                         chunk_size=self.corr_chunk_size)
+        else:  # local matching
+            flow_pred, prob = local_correlation_softmax(feature0, feature1, corr_radius)
+        if record is not None:
+            self.recorder.end(record, flow_pred)
+
+        # chunked global matching never materialises the probabilities
+        confidence = prob.max(dim=-1)[0].mean(dim=-1)[:feature0.size(0)] if prob is not None else None
+
+        # flow or residual flow
+        flow = flow + flow_pred if flow is not None else flow_pred
+
+        return flow, feature0, feature1, confidence
+
+    def forward_scales(self, feature0_list, feature1_list,
+                       attn_splits_list, corr_radius_list, prop_radius_list,
+                       pred_bidir_flow=False, init_flow=None, skip_global=False, min_confidence=None):
+        # flow_preds is None when the warm start init_flow is rejected for a low match confidence
+        flow_preds = []
         flow = init_flow
-
-        assert len(attn_splits_list) == len(corr_radius_list) == len(prop_radius_list) == self.num_scales
+        match_confidence = None
 
         for scale_idx in range(self.num_scales):
             feature0, feature1 = feature0_list[scale_idx], feature1_list[scale_idx]
@@ -199,29 +224,22 @@ class GMFlow(nn.Module):
             if scale_idx > 0:
                 flow = F.interpolate(flow, scale_factor=2, mode='bilinear', align_corners=True) * 2
 
-            if flow is not None:
-                flow = flow.detach()
-                feature1 = flow_warp(feature1, flow)  # [B, C, H, W]
-
             attn_splits = attn_splits_list[scale_idx]
             corr_radius = corr_radius_list[scale_idx]
             prop_radius = prop_radius_list[scale_idx]
 
-            # add position to features
-            feature0, feature1 = feature_add_position(feature0, feature1, attn_splits, self.feature_channels)
+            if skip_global and init_flow is not None and corr_radius == -1 and scale_idx < self.num_scales - 1:
+                # the warm start stands in for global matching, it is refined at the next scale
+                continue
 
-            # Transformer
-            feature0, feature1 = self.transformer(feature0, feature1, attn_num_splits=attn_splits)
-            # feature0, feature1 = self.DRDBs(feature0, feature1)
+            flow, feature0, feature1, confidence = self.match_scale(feature0, feature1, flow, attn_splits,
+                                                                     corr_radius, pred_bidir_flow)
 
-            # correlation and softmax
-            if corr_radius == -1:  # global matching
-                flow_pred = global_correlation_softmax(feature0, feature1, pred_bidir_flow)[0]
-            else:  # local matching
-                flow_pred = local_correlation_softmax(feature0, feature1, corr_radius)[0]
-
-            # flow or residual flow
-            flow = flow + flow_pred if flow is not None else flow_pred
+            if match_confidence is None:
+                match_confidence = confidence
+                if (init_flow is not None and min_confidence is not None and confidence is not None
+                        and confidence.min().item() < min_confidence):
+                    return {'flow_preds': None, 'match_confidence': confidence}
 
             # upsample to the original resolution for supervison
             if self.training:  # only need to upsample intermediate flow predictions at training time
@@ -229,11 +247,13 @@ class GMFlow(nn.Module):
                 flow_preds.append(flow_bilinear)
 
             # flow propagation with self-attnqqa
-            if pred_bidir_flow and scale_idx == 0:
+            if pred_bidir_flow and flow.size(0) > feature0.size(0):
+                # global matching at the first scale returned forward and backward flow
                 feature0 = torch.cat((feature0, feature1), dim=0)  # [2*B, C, H, W] for propagation
             flow = self.feature_flow_attn(feature0, flow.detach(),
                                           local_window_attn=prop_radius > 0,
-                                          local_window_radius=prop_radius)
+                                          local_window_radius=prop_radius,
+                                          chunk_size=self.corr_chunk_size)
 
             # bilinear upsampling at training time except the last one
             if self.training and scale_idx < self.num_scales - 1:
@@ -244,6 +264,43 @@ class GMFlow(nn.Module):
                 flow_up = self.upsample_flow(flow, feature0)
                 flow_preds.append(flow_up)
 
-        results_dict.update({'flow_preds': flow_preds})
+        return {'flow_preds': flow_preds, 'match_confidence': match_confidence}
+
+    def forward(self, img0, img1,
+                attn_splits_list=None,
+                corr_radius_list=None,
+                prop_radius_list=None,
+                pred_bidir_flow=False,
+                init_flow=None,
+                skip_global=False,
+                min_confidence=None,
+                **kwargs,
+                ):
+        """
+        init_flow warm-starts the first scale. With skip_global, global matching scales are skipped
+        for it as long as a later scale refines the flow. With min_confidence, a warm start whose
+        mean best-match probability at the first matched scale falls below it is discarded, e.g.
+        after a scene cut, and the flow is estimated from scratch on the same features.
+        """
+
+        # img0, img1 = normalize_img(img0, img1)  # [B, 3, H, W]
+
+        # resolution low to high， list = [1, 128, 40, 40]
+        feature0_list, feature1_list = self.extract_feature(img0, img1)  # list of features
+
+        assert len(attn_splits_list) == len(corr_radius_list) == len(prop_radius_list) == self.num_scales
+
+        results_dict = self.forward_scales(feature0_list, feature1_list,
+                                           attn_splits_list, corr_radius_list, prop_radius_list,
+                                           pred_bidir_flow, init_flow, skip_global, min_confidence)
+        warm_start_rejected = results_dict['flow_preds'] is None
+        if warm_start_rejected:
+            # keep reporting the confidence that rejected the warm start
+            results_dict['flow_preds'] = self.forward_scales(feature0_list, feature1_list,
+                                                             attn_splits_list, corr_radius_list,
+                                                             prop_radius_list, pred_bidir_flow)['flow_preds']
+
+        results_dict.update({'corr_chunk_size': self.corr_chunk_size,
+                             'warm_start_rejected': warm_start_rejected})
 
         return results_dict
@@ -2,11 +2,17 @@ import torch
 import torch.nn.functional as F
 
 from .geometry import coords_grid, generate_window_grid, normalize_coords
+from .utils import chunked_softmax_matmul, run_in_fp32
 
 
+@run_in_fp32
 def global_correlation_softmax(feature0, feature1,
                                pred_bidir_flow=False,
+                               chunk_size=None,
                                ):
+    if chunk_size:
+        return global_correlation_softmax_chunked(feature0, feature1, pred_bidir_flow, chunk_size)
+
     # global correlation
     b, c, h, w = feature0.shape
     feature0 = feature0.view(b, c, -1).permute(0, 2, 1)  # [B, H*W, C]
@@ -15,7 +21,7 @@ def global_correlation_softmax(feature0, feature1,
     correlation = torch.matmul(feature0, feature1).view(b, h, w, h, w) / (c ** 0.5)  # [B, H, W, H, W]
 
     # flow from softmax
-    init_grid = coords_grid(b, h, w).to(correlation.device)  # [B, 2, H, W]
+    init_grid = coords_grid(b, h, w, device=correlation.device)  # [B, 2, H, W]
     grid = init_grid.view(b, 2, -1).permute(0, 2, 1)  # [B, H*W, 2]
 
     correlation = correlation.view(b, h * w, h * w)  # [B, H*W, H*W]
@@ -36,11 +42,42 @@ def global_correlation_softmax(feature0, feature1,
     return flow, prob
 
 
+@run_in_fp32
+def global_correlation_softmax_chunked(feature0, feature1,
+                                       pred_bidir_flow=False,
+                                       chunk_size=4096,
+                                       ):
+    # same flow as global_correlation_softmax with memory bounded by chunk_size instead of (H*W)^2,
+    # the full matching probability is never materialised and None is returned in its place
+    b, c, h, w = feature0.shape
+    feature0 = feature0.view(b, c, -1).permute(0, 2, 1)  # [B, H*W, C]
+    feature1 = feature1.view(b, c, -1).permute(0, 2, 1)  # [B, H*W, C]
+
+    init_grid = coords_grid(b, h, w, device=feature0.device)  # [B, 2, H, W]
+    grid = init_grid.view(b, 2, -1).permute(0, 2, 1)  # [B, H*W, 2]
+
+    correspondence = chunked_softmax_matmul(feature0, feature1, grid, chunk_size, c ** 0.5)  # [B, H*W, 2]
+
+    if pred_bidir_flow:
+        # softmax over the transposed correlation is the correlation with the features swapped
+        correspondence_bwd = chunked_softmax_matmul(feature1, feature0, grid, chunk_size, c ** 0.5)
+        correspondence = torch.cat((correspondence, correspondence_bwd), dim=0)  # [2*B, H*W, 2]
+        init_grid = init_grid.repeat(2, 1, 1, 1)  # [2*B, 2, H, W]
+        b = b * 2
+
+    correspondence = correspondence.view(b, h, w, 2).permute(0, 3, 1, 2)  # [B, 2, H, W]
+
+    flow = correspondence - init_grid
+
+    return flow, None
+
+
+@run_in_fp32
 def local_correlation_softmax(feature0, feature1, local_radius,
                               padding_mode='zeros',
                               ):
     b, c, h, w = feature0.size()
-    coords_init = coords_grid(b, h, w).to(feature0.device)  # [B, 2, H, W]
+    coords_init = coords_grid(b, h, w, device=feature0.device)  # [B, 2, H, W]
     coords = coords_init.view(b, 2, -1).permute(0, 2, 1)  # [B, H*W, 2]
 
     local_h = 2 * local_radius + 1
@@ -49,7 +86,7 @@ def local_correlation_softmax(feature0, feature1, local_radius,
     window_grid = generate_window_grid(-local_radius, local_radius,
                                        -local_radius, local_radius,
                                        local_h, local_w, device=feature0.device)  # [2R+1, 2R+1, 2]
-    window_grid = window_grid.reshape(-1, 2).repeat(b, 1, 1, 1)  # [B, 1, (2R+1)^2, 2]
+    window_grid = window_grid.reshape(1, 1, -1, 2)  # [1, 1, (2R+1)^2, 2], broadcast over B and H*W
     sample_coords = coords.unsqueeze(-2) + window_grid  # [B, H*W, (2R+1)^2, 2]
 
     sample_coords_softmax = sample_coords
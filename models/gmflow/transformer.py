@@ -2,7 +2,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from .utils import split_feature, merge_splits
+from .utils import split_feature, merge_splits, chunked_softmax_matmul, run_in_fp32
 
 
 def single_head_full_attention(q, k, v):
@@ -17,11 +17,11 @@ def single_head_full_attention(q, k, v):
 
 
 def generate_shift_window_attn_mask(input_resolution, window_size_h, window_size_w,
-                                    shift_size_h, shift_size_w, device=torch.device('cuda')):
+                                    shift_size_h, shift_size_w, device=None):
     # Ref: https://github.com/microsoft/Swin-Transformer/blob/main/models/swin_transformer.py
     # calculate attention mask for SW-MSA
     h, w = input_resolution
-    img_mask = torch.zeros((1, h, w, 1)).to(device)  # 1 H W 1
+    img_mask = torch.zeros((1, h, w, 1), device=device)  # 1 H W 1
     h_slices = (slice(0, -window_size_h),
                 slice(-window_size_h, -shift_size_h),
                 slice(-shift_size_h, None))
@@ -340,9 +340,12 @@ class FeatureFlowAttention(nn.Module):
             if p.dim() > 1:
                 nn.init.xavier_uniform_(p)
 
+    # the propagated flow is accumulated across scales, so it stays in fp32 under autocast
+    @run_in_fp32
     def forward(self, feature0, flow,
                 local_window_attn=False,
                 local_window_radius=1,
+                chunk_size=None,
                 **kwargs,
                 ):
         # q, k: feature [B, C, H, W], v: flow [B, 2, H, W]
@@ -365,10 +368,13 @@ class FeatureFlowAttention(nn.Module):
 
         value = flow.view(b, flow.size(1), h * w).permute(0, 2, 1)  # [B, H*W, 2]
 
-        scores = torch.matmul(query, key.permute(0, 2, 1)) / (c ** 0.5)  # [B, H*W, H*W]
-        prob = torch.softmax(scores, dim=-1)
+        if chunk_size:
+            out = chunked_softmax_matmul(query, key, value, chunk_size, c ** 0.5)  # [B, H*W, 2]
+        else:
+            scores = torch.matmul(query, key.permute(0, 2, 1)) / (c ** 0.5)  # [B, H*W, H*W]
+            prob = torch.softmax(scores, dim=-1)
 
-        out = torch.matmul(prob, value)  # [B, H*W, 2]
+            out = torch.matmul(prob, value)  # [B, H*W, 2]
         out = out.view(b, h, w, value.size(-1)).permute(0, 3, 1, 2)  # [B, 2, H, W]
 
         return out
@@ -1,5 +1,28 @@
+import functools
 import torch
 from .position import PositionEmbeddingSine
+from .geometry import cached_grid
+
+
+# number of autocast regions entered by SingleModel.run_precision, so that the fp32 path never
+# queries autocast state, whose per-device form only exists in recent pytorch
+autocast_depth = 0
+
+
+def run_in_fp32(func):
+    # keeps a numerically sensitive op in fp32 under autocast: floating point tensor arguments
+    # are cast up and autocast is disabled while it runs, outside autocast nothing changes
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not autocast_depth:
+            return func(*args, **kwargs)
+        device_type = next((a.device.type for a in args if torch.is_tensor(a)), 'cpu')
+        args = [a.float() if torch.is_tensor(a) and a.is_floating_point() else a for a in args]
+        kwargs = dict((k, v.float() if torch.is_tensor(v) and v.is_floating_point() else v)
+                      for k, v in kwargs.items())
+        with torch.autocast(device_type, enabled=False):
+            return func(*args, **kwargs)
+    return wrapper
 
 
 def split_feature(feature,
@@ -63,22 +86,67 @@ def normalize_img(img0, img1):
     return img0, img1
 
 
+def chunked_softmax_matmul(query, key, value, chunk_size, temperature=1.):
+    # softmax(query @ key^T / temperature) @ value without materialising the [B, L, S] scores:
+    # query rows are processed in blocks and keys are streamed with an online softmax,
+    # so at most [B, chunk_size, chunk_size] scores exist at a time
+    # query: [B, L, C], key: [B, S, C], value: [B, S, D]
+    b, l, _ = query.size()
+    s = key.size(1)
+    out = value.new_empty(b, l, value.size(-1))
+
+    for i in range(0, l, chunk_size):
+        q = query[:, i:i + chunk_size]
+        row_max, row_sum, acc = None, None, None
+
+        for j in range(0, s, chunk_size):
+            scores = torch.matmul(q, key[:, j:j + chunk_size].permute(0, 2, 1)) / temperature  # [B, q, k]
+            block_max = scores.max(dim=-1, keepdim=True)[0]
+
+            if row_max is None:
+                row_max = block_max
+                weights = torch.exp(scores - row_max)
+                row_sum = weights.sum(dim=-1, keepdim=True)
+                acc = torch.matmul(weights, value[:, j:j + chunk_size])
+            else:
+                # rescale what was accumulated so far to the new running maximum
+                new_max = torch.max(row_max, block_max)
+                correction = torch.exp(row_max - new_max)
+                weights = torch.exp(scores - new_max)
+                row_sum = row_sum * correction + weights.sum(dim=-1, keepdim=True)
+                acc = acc * correction + torch.matmul(weights, value[:, j:j + chunk_size])
+                row_max = new_max
+
+        out[:, i:i + chunk_size] = acc / row_sum
+
+    return out
+
+
+def position_embedding(h, w, feature_channels, device=None):
+    # the sine embedding only depends on the window size and channels, so it is computed once
+    def build():
+        pos_enc = PositionEmbeddingSine(num_pos_feats=feature_channels // 2)
+        return pos_enc(torch.empty(1, feature_channels, h, w, device=device))  # [1, C, H, W]
+
+    return cached_grid(('position', h, w, feature_channels, torch.device(device or 'cpu')), build)
+
+
 def feature_add_position(feature0, feature1, attn_splits, feature_channels):
-    pos_enc = PositionEmbeddingSine(num_pos_feats=feature_channels // 2)
+    b, c, h, w = feature0.size()
 
     if attn_splits > 1:  # add position in splited window
-        feature0_splits = split_feature(feature0, num_splits=attn_splits)
-        feature1_splits = split_feature(feature1, num_splits=attn_splits)
-
-        position = pos_enc(feature0_splits)
+        assert h % attn_splits == 0 and w % attn_splits == 0
+        h_split = h // attn_splits
+        w_split = w // attn_splits
 
-        feature0_splits = feature0_splits + position
-        feature1_splits = feature1_splits + position
+        # the same window embedding is broadcast over all K*K windows instead of split / merge
+        position = position_embedding(h_split, w_split, feature_channels, feature0.device)
+        position = position[:, :, None, :, None, :]  # [1, C, 1, H/K, 1, W/K]
 
-        feature0 = merge_splits(feature0_splits, num_splits=attn_splits)
-        feature1 = merge_splits(feature1_splits, num_splits=attn_splits)
+        feature0 = (feature0.view(b, c, attn_splits, h_split, attn_splits, w_split) + position).view(b, c, h, w)
+        feature1 = (feature1.view(b, c, attn_splits, h_split, attn_splits, w_split) + position).view(b, c, h, w)
     else:
-        position = pos_enc(feature0)
+        position = position_embedding(h, w, feature_channels, feature0.device)  # [1, C, H, W]
 
         feature0 = feature0 + position
         feature1 = feature1 + position
@@ -0,0 +1,200 @@
+import collections
+import ctypes
+import ctypes.util
+import json
+import os
+import resource
+import time
+import torch
+
+LIBC = ctypes.CDLL(ctypes.util.find_library('c')) if ctypes.util.find_library('c') else None
+
+
+def tensor_shapes(obj):
+    # shapes of the tensors in a network input or output, nested lists, tuples and dicts flattened
+    if torch.is_tensor(obj):
+        return [list(obj.shape)]
+    if isinstance(obj, (list, tuple)):
+        return [shape for item in obj for shape in tensor_shapes(item)]
+    if isinstance(obj, dict):
+        return [shape for item in obj.values() for shape in tensor_shapes(item)]
+    return []
+
+
+def resident_memory(device):
+    # allocated CUDA memory, or resident set size, in bytes
+    if device.type == 'cuda':
+        return torch.cuda.memory_allocated(device)
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def peak_memory(device):
+    # peak allocated CUDA memory, or peak resident set size, since the last reset in bytes
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    # without /proc the peak cannot be reset, ru_maxrss is in KB on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_memory(device):
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+        return
+    # memory freed earlier is handed back to the system first, so that it does not count as resident
+    if LIBC is not None and hasattr(LIBC, 'malloc_trim'):
+        LIBC.malloc_trim(0)
+    try:
+        # lowers the peak resident set size to the current one
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+class Span(object):
+    # context manager around a stage, assign outputs before leaving it to record their shapes
+    def __init__(self, recorder, stage, inputs):
+        self.recorder = recorder
+        self.stage = stage
+        self.inputs = inputs
+        self.outputs = None
+
+    def __enter__(self):
+        self.record = self.recorder.begin(self.stage, self.inputs)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.end(self.record, self.outputs)
+        return False
+
+
+class StageRecorder(object):
+    """Wall time, CPU time, peak memory and tensor shapes of named stages.
+
+    Every finished span is a dict with the stage, its wall and CPU time in seconds, the peak memory
+    reached in bytes (resident set size on CPU, allocated memory on CUDA), the input and output
+    tensor shapes, the enclosing stage and a copy of tags. It is passed to every callback and
+    added to per-stage totals that prometheus() formats. CPU time is that of the whole process,
+    intra-op threads included. Spans nest; a nested span also counts towards the peak memory of
+    the spans around it.
+    """
+
+    def __init__(self, device=None, memory=True):
+        self.device = device if device is not None else torch.device('cpu')
+        self.memory = memory
+        self.callbacks = []
+        self.tags = {}
+        self.totals = collections.OrderedDict()
+        self.stack = []
+        self.handles = []
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+        return callback
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def span(self, stage, inputs=()):
+        return Span(self, stage, inputs)
+
+    def update_peaks(self):
+        if self.stack:
+            peak = peak_memory(self.device)
+            for record in self.stack:
+                record['peak_memory'] = max(record['peak_memory'], peak)
+
+    def begin(self, stage, inputs=()):
+        record = {'stage': stage, 'parent': self.stack[-1]['stage'] if self.stack else None,
+                  'input_shapes': tensor_shapes(inputs)}
+        if self.memory:
+            # the peak so far belongs to the enclosing spans
+            self.update_peaks()
+            reset_peak_memory(self.device)
+            record['peak_memory'] = 0
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        self.stack.append(record)
+        record['wall'] = time.perf_counter()
+        record['cpu'] = time.process_time()
+        return record
+
+    def end(self, record, outputs=None):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        record['wall'] = time.perf_counter() - record['wall']
+        record['cpu'] = time.process_time() - record['cpu']
+        if self.memory:
+            self.update_peaks()
+        self.stack.remove(record)
+        record['output_shapes'] = tensor_shapes(outputs)
+        record['tags'] = dict(self.tags)
+
+        total = self.totals.setdefault(record['stage'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_memory': 0})
+        total['calls'] += 1
+        total['wall'] += record['wall']
+        total['cpu'] += record['cpu']
+        total['peak_memory'] = max(total['peak_memory'], record.get('peak_memory', 0))
+        for callback in self.callbacks:
+            callback(record)
+        return record
+
+    def attach(self, module, stage):
+        # spans around every forward call of module, until detach()
+        records = []
+
+        def pre_hook(module, inputs):
+            records.append(self.begin(stage, inputs))
+
+        def hook(module, inputs, outputs):
+            self.end(records.pop(), outputs)
+
+        self.handles.append(module.register_forward_pre_hook(pre_hook))
+        self.handles.append(module.register_forward_hook(hook, always_call=True))
+
+    def detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def prometheus(self, prefix='merf_stage'):
+        # the totals in the Prometheus text exposition format
+        metrics = [('seconds_total', 'wall', 'counter', 'Wall time spent in the stage.'),
+                   ('cpu_seconds_total', 'cpu', 'counter', 'Process CPU time spent in the stage.'),
+                   ('calls_total', 'calls', 'counter', 'Number of times the stage ran.')]
+        if self.memory:
+            metrics.append(('peak_memory_bytes', 'peak_memory', 'gauge', 'Largest peak memory of a single call.'))
+        lines = []
+        for name, key, kind, description in metrics:
+            lines.append('# HELP %s_%s %s' % (prefix, name, description))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+            for stage, total in self.totals.items():
+                lines.append('%s_%s{stage="%s"} %r' % (prefix, name, stage, total[key]))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # written to a temporary file first, so that a collector never reads half a file
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+
+class JsonlWriter(object):
+    # callback appending every span to a file as one line of JSON
+    def __init__(self, path):
+        self.file = open(path, 'a', buffering=1)
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.file.close()
@@ -5,7 +5,7 @@ import torch.nn.functional as F
 from models.U_net import AttU_Net
 from models.swinir import SwinIR
 from models.gmflow.gmflow import GMFlow
-import kornia
+from models.gmflow.geometry import pixel_grid
 
 
 def weights_init(m):
@@ -17,14 +17,28 @@ def weights_init(m):
         m.bias.data.fill_(0)
 
 
+def init_net(net, device=None, gpu_ids=[]):
+    # place the network on its device, DataParallel only pays off across several GPUs
+    if device is None:
+        device = torch.device('cpu')
+    net.to(device)
+    if device.type == 'cuda' and len(gpu_ids) > 1:
+        net = torch.nn.DataParallel(net, device_ids=gpu_ids)
+    return net
+
+
+def get_module(net):
+    # the wrapped network, for calling methods other than forward
+    return net.module if isinstance(net, torch.nn.DataParallel) else net
+
+
 def define_A(opt, test_mode=False):
     netA = align_FG(opt, test_mode)
-    netA = torch.nn.DataParallel(netA)
-    netA.cuda()
+    netA = init_net(netA, opt.device, opt.gpu_ids)
     return netA
 
 
-def define_G(gpu_ids=[], height=320, width=320, window_size=8):
+def define_G(gpu_ids=[], height=320, width=320, window_size=8, device=None):
     netG = None
     use_gpu = len(gpu_ids) > 0
 
@@ -35,12 +49,11 @@ def define_G(gpu_ids=[], height=320, width=320, window_size=8):
                   window_size=window_size, img_range=1., depths=[2, 2, 2],
                   embed_dim=64, num_heads=[2, 2, 2], mlp_ratio=2, upsampler='')
 
-    netG = torch.nn.DataParallel(netG)
-    netG.cuda()
+    netG = init_net(netG, device, gpu_ids)
     return netG
 
 
-def define_Att(gpu_ids=[]):
+def define_Att(gpu_ids=[], device=None):
     use_gpu = len(gpu_ids) > 0
 
     if use_gpu:
@@ -48,13 +61,12 @@ def define_Att(gpu_ids=[]):
 
     net = AttING(3, 64)
 
-    net = torch.nn.DataParallel(net)
-    net.cuda()
+    net = init_net(net, device, gpu_ids)
     net.apply(weights_init)
     return net
 
 
-def define_R(gpu_ids=[]):
+def define_R(gpu_ids=[], device=None):
     netR = None
     use_gpu = len(gpu_ids) > 0
 
@@ -62,7 +74,7 @@ def define_R(gpu_ids=[]):
         assert (torch.cuda.is_available())
 
     netR = AttU_Net(64 * 3, 3)
-    netR.cuda()
+    netR = init_net(netR, device, gpu_ids)
 
     return netR
 
@@ -137,7 +149,7 @@ def flow_warp(x, flow, interp_mode='bilinear', padding_mode='zeros', align_corne
     """
     n, _, h, w = x.size()
     # haodeh assert x.size()[-2:] == flow.size()[1:3] # temporaily turned off for image-wise shift
-    grid = kornia.utils.create_meshgrid(h, w, device=x.device).to(x.dtype)
+    grid = pixel_grid(h, w, normalized=True, device=x.device, dtype=x.dtype)  # [1, H, W, 2]
     vgrid = grid + flow
 
     # if use_pad_mask: # for PWCNet
@@ -193,14 +205,14 @@ def flow_warp2(x, flow, interp_mode='bilinear', padding_mode='zeros', align_corn
     """
     # haodeh assert x.size()[-2:] == flow.size()[1:3] # temporaily turned off for image-wise shift
     n, _, h, w = x.size()
+    # sampling positions stay in fp32, half precision cannot address every pixel of a large image,
+    # the warped output keeps the dtype of x
+    dtype = x.dtype
     x = x.float()
+    flow = flow.float()
     # create mesh grid
     # grid_y, grid_x = torch.meshgrid(torch.arange(0, h).type_as(x), torch.arange(0, w).type_as(x)) # an illegal memory access on TITAN RTX + PyTorch1.9.1
-    grid_y, grid_x = torch.meshgrid(torch.arange(0, h, dtype=x.dtype, device=x.device),
-                                    torch.arange(0, w, dtype=x.dtype, device=x.device))
-    grid = torch.stack((grid_x, grid_y), 2).float()  # W(x), H(y), 2
-    grid.requires_grad = False
-    grid = grid.type_as(x)
+    grid = pixel_grid(h, w, device=x.device, dtype=torch.float32)  # 1, H, W, 2. W(x), H(y)
     vgrid = grid + flow
 
     # if use_pad_mask: # for PWCNet
@@ -222,7 +234,7 @@ def flow_warp2(x, flow, interp_mode='bilinear', padding_mode='zeros', align_corn
         output11 = F.grid_sample(x, torch.stack((vgrid_x_ceil, vgrid_y_ceil), dim=3), mode='nearest',
                                  padding_mode=padding_mode, align_corners=align_corners)
 
-        return torch.cat([output00, output01, output10, output11], 1)
+        return torch.cat([output00, output01, output10, output11], 1).to(dtype)
 
     else:
         vgrid_x = 2.0 * vgrid[:, :, :, 0] / max(w - 1, 1) - 1.0
@@ -235,7 +247,7 @@ def flow_warp2(x, flow, interp_mode='bilinear', padding_mode='zeros', align_corn
         #     output = _flow_warp_masking(output)
 
         # TODO, what if align_corners=False
-        return output
+        return output.to(dtype)
 
 
 class AttentionModule(nn.Module):
@@ -291,6 +303,7 @@ class align_FG(nn.Module):
         self.relu = nn.ReLU(True)
 
         self.test_mode = test_mode
+        corr_chunk_size = getattr(opt, 'corr_chunk_size', 0)
         if test_mode:
             self.flow_net = GMFlow(feature_channels=128,
                                    num_scales=2,
@@ -299,6 +312,7 @@ class align_FG(nn.Module):
                                    attention_type='swin',
                                    ffn_dim_expansion=4,
                                    num_transformer_layers=6,
+                                   corr_chunk_size=corr_chunk_size,
                                    )
         else:
             self.flow_net = GMFlow(feature_channels=128,
@@ -308,6 +322,7 @@ class align_FG(nn.Module):
                                    attention_type='swin',
                                    ffn_dim_expansion=4,
                                    num_transformer_layers=6,
+                                   corr_chunk_size=corr_chunk_size,
                                    )
 
         for m in self.modules():
@@ -315,23 +330,59 @@ class align_FG(nn.Module):
                 n = m.kernel_size[0] * m.kernel_size[1] * m.out_channels
                 m.weight.data.normal_(0, math.sqrt(2. / n))
 
+    def estimate_flow(self, x, ref, pred_bidir_flow=False):
+        results = self.flow_net(ref, x, attn_splits_list=[2, 8],
+                                corr_radius_list=[-1, 4],
+                                prop_radius_list=[-1, 4],
+                                pred_bidir_flow=pred_bidir_flow,
+                                )
+        return results['flow_preds']
+
+    def estimate_flow_warm(self, x, ref, prev_flow=None, min_confidence=None):
+        """Flow of the next frame of a sequence, started from the flow of the previous one.
+
+        prev_flow is the full-resolution flow of the previous frame. It is downsampled to the
+        first scale and passed to GMFlow as init_flow, and the global matching scale is skipped:
+        the next scale refines the warm start with local matching only. If the mean best-match
+        probability of that matching falls below min_confidence, GMFlow discards the warm start
+        and runs global matching after all. Without prev_flow this is the regular estimate.
+
+        Returns:
+            dict: GMFlow results, with 'flow_preds', 'match_confidence' and 'warm_start_rejected'.
+        """
+        init_flow = None
+        if prev_flow is not None:
+            # the first scale works at 1 / (upsample_factor * 2 ** (num_scales - 1)) resolution
+            factor = self.flow_net.upsample_factor * 2 ** (self.flow_net.num_scales - 1)
+            h, w = x.size()[-2:]
+            init_flow = F.interpolate(prev_flow, size=(h // factor, w // factor), mode='area') / factor
+        return self.flow_net(ref, x, attn_splits_list=[2, 8],
+                             corr_radius_list=[-1, 4],
+                             prop_radius_list=[-1, 4],
+                             init_flow=init_flow,
+                             skip_global=True,
+                             min_confidence=min_confidence,
+                             )
+
     def forward(self, x, ref, x_ins):
-        ref_x = self.flow_net(ref, x, attn_splits_list=[2, 8],
-                              corr_radius_list=[-1, 4],
-                              prop_radius_list=[-1, 4],
-                              )
-        f = ref_x['flow_preds']
-        F_warped_move_ = flow_warp2(x_ins, f[-1].permute(0, 2, 3, 1))
+        if self.test_mode:
+            # inference only consumes the (ref, x) flow, the supervision flow is skipped
+            f = self.estimate_flow(x, ref)
+            f_sup = None
+        else:
+            # forward and backward flow in one batched pass, chunked as [ref -> x, x -> ref]
+            flow_preds = self.estimate_flow(x, ref, pred_bidir_flow=True)
+            f, f_sup = [], []
+            for flow in flow_preds:
+                flow_fwd, flow_bwd = flow.chunk(chunks=2, dim=0)
+                f.append(flow_fwd)
+                f_sup.append(flow_bwd)
 
-        x_ref = self.flow_net(x, ref, attn_splits_list=[2, 8],
-                              corr_radius_list=[-1, 4],
-                              prop_radius_list=[-1, 4],
-                              )
-        f_sup = x_ref['flow_preds']
+        F_warped_move_ = flow_warp2(x_ins, f[-1].permute(0, 2, 3, 1))
         return F_warped_move_, f, f_sup
 
 
-def define_F(gpu_ids=[], skip=False, opt=None):
+def define_F(gpu_ids=[], skip=False, opt=None, device=None):
     use_gpu = len(gpu_ids) > 0
 
     if use_gpu:
@@ -339,7 +390,6 @@ def define_F(gpu_ids=[], skip=False, opt=None):
 
     net = FuseModule()
 
-    net = torch.nn.DataParallel(net)
-    net.cuda()
+    net = init_net(net, device, gpu_ids)
     net.apply(weights_init)
     return net
@@ -0,0 +1,88 @@
+import torch
+from torch import nn
+from .networks import get_module
+
+
+class MERFPipeline(nn.Module):
+    """The five MERF networks as one module, from an exposure pair to the fused image.
+
+    forward(input_A, input_B) returns the refinement [B, 3, H, W] that SingleModel.predict()
+    converts to uint8, for H and W multiples of 32. Flow caching, tiling, sequence mode and
+    mixed precision stay in SingleModel. The module has no Python glue left between the
+    networks, so it can be traced to TorchScript, exported with torch.export or compiled.
+    """
+
+    def __init__(self, mapping, align, dual_att, netG, refinement_net):
+        super(MERFPipeline, self).__init__()
+        self.mapping = get_module(mapping)
+        self.align = get_module(align)
+        self.dual_att = get_module(dual_att)
+        self.netG = get_module(netG)
+        self.refinement_net = get_module(refinement_net)
+        self.avg_pool = nn.AvgPool2d(2, 2)
+        self.up = nn.Upsample(scale_factor=2, mode='bilinear', align_corners=True)
+
+    def forward(self, input_A, input_B):
+        identity, correct = self.mapping(torch.cat((input_A, input_B), dim=0))
+        identity_A, identity_B = identity.chunk(chunks=2, dim=0)
+        correct_A, correct_B = correct.chunk(chunks=2, dim=0)
+
+        align_B = self.align(correct_B, correct_A, identity_B)[0]
+        align_B, align_A = self.dual_att(align_B, identity_A)
+
+        o_lf, x_lf = self.netG(self.avg_pool(align_B), self.avg_pool(align_A))
+        detail = self.refinement_net(align_B, align_A, self.up(x_lf))
+        return detail + self.up(o_lf)
+
+
+class FixedSizeModule(nn.Module):
+    # a TorchScript trace only holds for the size it was traced at, other sizes are refused
+    def __init__(self, traced, height, width):
+        super(FixedSizeModule, self).__init__()
+        self.traced = traced
+        self.height = height
+        self.width = width
+
+    def forward(self, input_A, input_B):
+        if input_A.size(2) != self.height or input_A.size(3) != self.width:
+            raise RuntimeError('this TorchScript pipeline was traced for %dx%d inputs' % (self.height, self.width))
+        return self.traced(input_A, input_B)
+
+
+def export_program(pipeline, example_inputs, path, max_size=4096):
+    """Saves pipeline with torch.export, for any H and W that are multiples of 32 in [64, max_size].
+
+    The file loads with torch.export.load(path).module() in a process without the MERF sources.
+    """
+    from torch.export import Dim, export
+    height = Dim('height', min=2, max=max_size // 32)
+    width = Dim('width', min=2, max=max_size // 32)
+    sizes = {2: 32 * height, 3: 32 * width}
+    with torch.no_grad():
+        program = export(pipeline.eval(), tuple(example_inputs),
+                         dynamic_shapes={'input_A': sizes, 'input_B': sizes})
+    torch.export.save(program, path)
+    return program
+
+
+def export_torchscript(pipeline, example_inputs, path):
+    """Saves a frozen TorchScript trace of pipeline, valid for the size of example_inputs only.
+
+    The file loads with torch.jit.load(path) in a process without the MERF sources. It is frozen
+    but not passed through torch.jit.optimize_for_inference, whose MKLDNN constants do not load
+    back, call it after loading instead.
+    """
+    height, width = example_inputs[0].size()[-2:]
+    with torch.no_grad():
+        traced = torch.jit.trace(pipeline.eval(), tuple(example_inputs), check_trace=False)
+        scripted = torch.jit.script(FixedSizeModule(traced, int(height), int(width)))
+        frozen = torch.jit.freeze(scripted.eval())
+    frozen.save(path)
+    return frozen
+
+
+def load_exported(path):
+    # a callable pipeline from a file written by export_program (.pt2) or export_torchscript
+    if path.endswith('.pt2'):
+        return torch.export.load(path).module()
+    return torch.jit.load(path)
@@ -0,0 +1,34 @@
+import copy
+import itertools
+import torch
+import torch.nn as nn
+
+
+def quantize_linear_dynamic(net):
+    # int8 weights for every nn.Linear of net, activations are quantized on the fly, in place
+    return torch.ao.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def prepare_static(net, example_inputs):
+    """Copy of net with observers recording activation ranges, for static int8 quantization.
+
+    The network is traced with torch.fx, which also folds BatchNorm into the preceding
+    convolutions. example_inputs only need the right number of channels.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    return prepare_fx(copy.deepcopy(net).eval(), qconfig_mapping, example_inputs)
+
+
+def convert_static(observed):
+    # int8 network from an observed one, with the ranges recorded so far
+    from torch.ao.quantization.quantize_fx import convert_fx
+    return convert_fx(observed)
+
+
+def calibrate(model, calibration_data, num_batches):
+    # runs the whole pipeline so that observed networks see the activations of real pairs
+    for data in itertools.islice(calibration_data, num_batches):
+        model.set_input(data)
+        model.predict()
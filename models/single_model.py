@@ -1,58 +1,37 @@
+import os
 import torch
 from torch import nn
 from torch.autograd import Variable
 from .base_model import BaseModel
 from . import networks
+from . import tiling
+from . import quantization
+from .gmflow import utils as gmflow_utils
 import torch.nn.functional as F
 import numpy as np
 from math import exp
 
 
-def latent2im(image_tensor, imtype=np.uint8):
-    image_numpy = image_tensor[0].detach().cpu().float().numpy()
-    image_numpy = (np.transpose(image_numpy, (1, 2, 0))) * 255.0
-    image_numpy = np.maximum(image_numpy, 0)
-    image_numpy = np.minimum(image_numpy, 255)
-    return image_numpy.astype(imtype)
-
-
-def flow_warp2(x, flow, interp_mode='bilinear', padding_mode='zeros', align_corners=True, use_pad_mask=False):
-    n, _, h, w = x.size()
-    x = x.float()
-
-    grid_y, grid_x = torch.meshgrid(torch.arange(0, h, dtype=x.dtype, device=x.device),
-                                    torch.arange(0, w, dtype=x.dtype, device=x.device))
-    grid = torch.stack((grid_x, grid_y), 2).float()  # W(x), H(y), 2
-    grid.requires_grad = False
-    grid = grid.type_as(x)
-    vgrid = grid + flow
-
-    if interp_mode == 'nearest4':  # todo: bug, no gradient for flow model in this case!!! but the result is good
-        vgrid_x_floor = 2.0 * torch.floor(vgrid[:, :, :, 0]) / max(w - 1, 1) - 1.0
-        vgrid_x_ceil = 2.0 * torch.ceil(vgrid[:, :, :, 0]) / max(w - 1, 1) - 1.0
-        vgrid_y_floor = 2.0 * torch.floor(vgrid[:, :, :, 1]) / max(h - 1, 1) - 1.0
-        vgrid_y_ceil = 2.0 * torch.ceil(vgrid[:, :, :, 1]) / max(h - 1, 1) - 1.0
+PRECISION_STAGES = ('mapping', 'flow', 'fuse', 'swin', 'refine')
+PRECISION_DTYPES = {'bf16': torch.bfloat16, 'fp16': torch.float16}
 
-        output00 = F.grid_sample(x, torch.stack((vgrid_x_floor, vgrid_y_floor), dim=3), mode='nearest',
-                                 padding_mode=padding_mode, align_corners=align_corners)
-        output01 = F.grid_sample(x, torch.stack((vgrid_x_floor, vgrid_y_ceil), dim=3), mode='nearest',
-                                 padding_mode=padding_mode, align_corners=align_corners)
-        output10 = F.grid_sample(x, torch.stack((vgrid_x_ceil, vgrid_y_floor), dim=3), mode='nearest',
-                                 padding_mode=padding_mode, align_corners=align_corners)
-        output11 = F.grid_sample(x, torch.stack((vgrid_x_ceil, vgrid_y_ceil), dim=3), mode='nearest',
-                                 padding_mode=padding_mode, align_corners=align_corners)
 
-        return torch.cat([output00, output01, output10, output11], 1)
+def to_float(outputs):
+    # fp32 copies of the tensors in a network output
+    if torch.is_tensor(outputs):
+        return outputs.float()
+    if isinstance(outputs, (list, tuple)):
+        return type(outputs)(to_float(output) for output in outputs)
+    return outputs
 
-    else:
-        vgrid_x = 2.0 * vgrid[:, :, :, 0] / max(w - 1, 1) - 1.0
-        vgrid_y = 2.0 * vgrid[:, :, :, 1] / max(h - 1, 1) - 1.0
-        vgrid_scaled = torch.stack((vgrid_x, vgrid_y), dim=3)
-        output = F.grid_sample(x, vgrid_scaled, mode=interp_mode, padding_mode=padding_mode,
-                               align_corners=align_corners)
 
-        # TODO, what if align_corners=False
-        return output
+def latent2im(image_tensor, imtype=np.uint8):
+    # [B, C, H, W] -> [B, H, W, C]
+    image_numpy = image_tensor.detach().cpu().float().numpy()
+    image_numpy = (np.transpose(image_numpy, (0, 2, 3, 1))) * 255.0
+    image_numpy = np.maximum(image_numpy, 0)
+    image_numpy = np.minimum(image_numpy, 255)
+    return image_numpy.astype(imtype)
 
 
 class SingleModel(BaseModel):
@@ -65,32 +44,31 @@ class SingleModel(BaseModel):
         nb = opt.batchSize
         size = opt.fineSize
         self.opt = opt
-        self.input_A = self.Tensor(nb, opt.input_nc, 600, 400)
+        self.input_A = torch.empty(nb, opt.input_nc, 600, 400, device=self.device)
         # self.input_A2 = self.Tensor(nb, opt.input_nc, 600, 400)
-        self.input_B = self.Tensor(nb, opt.output_nc, 600, 400)
+        self.input_B = torch.empty(nb, opt.output_nc, 600, 400, device=self.device)
 
         self.avg_pool = nn.AvgPool2d(2, 2)
 
-        self.netA = networks.define_A(opt)
+        self.netA = networks.define_A(opt, test_mode=not self.isTrain)
+        if opt.corr_chunk_size > 0:
+            print('global correlation is computed in chunks of %d pixels' % opt.corr_chunk_size)
         # self.netA.load_state_dict(torch.load("./checkpoints/Final_Flow/800_net_A.pth"), strict=True)
         window_size = 4
-        self.Mapping = networks.define_Att()
-        self.Dual_Att = networks.define_F()
+        self.Mapping = networks.define_Att(self.gpu_ids, device=self.device)
+        self.Dual_Att = networks.define_F(self.gpu_ids, device=self.device)
 
         # self.Mapping.load_state_dict(torch.load("./checkpoints/Final_Flow/800_net_M.pth"), strict=True)
 
-        self.netG = networks.define_G(gpu_ids=[], window_size=window_size)
+        self.netG = networks.define_G(gpu_ids=self.gpu_ids, window_size=window_size, device=self.device)
         # self.netG.load_state_dict(torch.load("./checkpoints/Ex_S_SICE/400_net_G.pth"), strict=True)
 
-        self.refinement_net = networks.define_R()
+        self.refinement_net = networks.define_R(self.gpu_ids, device=self.device)
         # self.refinement_net.load_state_dict(torch.load("./checkpoints/Ex_S_SICE/400_net_R.pth"), strict=True)
 
         which_epoch = 400
-        self.load_network(self.netG, 'G', which_epoch)
-        self.load_network(self.Dual_Att, 'D', which_epoch)
-        self.load_network(self.Mapping, 'M', which_epoch)
-        self.load_network(self.netA, 'A', which_epoch)
-        self.load_network(self.refinement_net, 'R', which_epoch)
+        self.load_networks([(self.netG, 'G'), (self.Dual_Att, 'D'), (self.Mapping, 'M'),
+                            (self.netA, 'A'), (self.refinement_net, 'R')], which_epoch)
 
         print('---------- Networks initialized -------------')
 
@@ -99,37 +77,331 @@ class SingleModel(BaseModel):
         self.netA.eval()
         self.Dual_Att.eval()
         self.refinement_net.eval()
+        if not self.isTrain:
+            networks.get_module(self.refinement_net).fuse_for_inference()
+        self._checkpoint_id = None
+
+        self.precision_stages = set()
+        if opt.mixed_precision:
+            self.precision_stages = set(stage for stage in opt.precision_stages.split(',') if stage)
+            unknown = self.precision_stages.difference(PRECISION_STAGES)
+            if unknown or opt.precision_dtype not in PRECISION_DTYPES:
+                raise ValueError('unknown precision stage or dtype: %s, %s' % (', '.join(sorted(unknown)), opt.precision_dtype))
+            self.precision_dtype = PRECISION_DTYPES[opt.precision_dtype]
+            print('%s autocast for %s' % (opt.precision_dtype, ', '.join(sorted(self.precision_stages))))
+
+        if getattr(opt, 'sequence', False):
+            assert opt.batchSize == 1, 'sequence mode processes one frame at a time, use --batchSize 1'
+            if opt.tile_size > 0:
+                raise ValueError('--sequence warm-starts whole-image flows, it cannot be combined with --tile_size')
+        self.reset_sequence()
+
+        self.recorder = None
+        self.compiled = None
+        if getattr(opt, 'compile', False) and (opt.tile_size > 0 or opt.sequence or opt.flow_cache_dir or opt.mixed_precision):
+            raise ValueError('--compile runs the plain pipeline, without tiling, sequence mode, flow cache or mixed precision')
+
+        self.flow_cache = None
+        if opt.flow_cache_dir:
+            from .flow_cache import FlowCache, state_hash
+            cache_id = state_hash(self.Mapping, self.netA)
+            # flows estimated under autocast differ from fp32 ones, mapping feeds the flow network
+            flow_stages = sorted(self.precision_stages.intersection(('mapping', 'flow')))
+            if flow_stages:
+                cache_id += '-%s-%s' % (opt.precision_dtype, ','.join(flow_stages))
+            self.flow_cache = FlowCache(opt.flow_cache_dir, opt.flow_cache_size * 1024 * 1024, cache_id)
+            print('flows are cached in %s' % opt.flow_cache_dir)
         print('-----------------------------------------------')
 
+    def quantize(self, calibration_data=None):
+        """int8 CPU inference.
+
+        The Linear layers of the GMFlow transformer and of SwinIR are quantized dynamically.
+        AttU_Net is quantized statically, with activation ranges calibrated by running the
+        pipeline on --calibration_size batches of calibration_data. Quantized networks are saved
+        as <epoch>_net_<label>_int8_<id>.pth next to the fp32 checkpoints, where id starts the
+        checkpoint_id of the fp32 weights, and loaded from there when present, so calibration
+        only runs once per checkpoint and new fp32 weights are calibrated again.
+        """
+        assert self.device.type == 'cpu', 'int8 quantization runs on CPU only'
+        if self.precision_stages.intersection(('flow', 'swin', 'refine')):
+            raise ValueError('--quantize cannot be combined with --mixed_precision for flow, swin or refine')
+        which_epoch = 400
+        # int8 files of other fp32 weights are left alone
+        suffix = 'int8_%s' % self.checkpoint_id[:12]
+        labels = dict((label, '%s_%s' % (label, suffix)) for label in ('A', 'G', 'R'))
+
+        quantization.quantize_linear_dynamic(networks.get_module(self.netA).flow_net.transformer)
+        quantization.quantize_linear_dynamic(networks.get_module(self.netG))
+        # int8 flows differ from fp32 ones, and calibration below already runs the int8 netA
+        if self.flow_cache is not None:
+            self.flow_cache.checkpoint_id += '-int8'
+
+        example_inputs = tuple(torch.zeros(1, 64, 32, 32) for _ in range(3))
+        observed = quantization.prepare_static(networks.get_module(self.refinement_net), example_inputs)
+        loaded = []
+        for network, label in ((self.netA, labels['A']), (self.netG, labels['G'])):
+            if os.path.exists(os.path.join(self.save_dir, '%s_net_%s.pth' % (which_epoch, label))):
+                self.load_network(network, label, which_epoch)
+                loaded.append(label)
+
+        if os.path.exists(os.path.join(self.save_dir, '%s_net_%s.pth' % (which_epoch, labels['R']))):
+            self.refinement_net = quantization.convert_static(observed)
+            self.load_network(self.refinement_net, labels['R'], which_epoch)
+            loaded.append(labels['R'])
+        else:
+            assert calibration_data is not None, 'AttU_Net needs calibration data for static quantization'
+            self.refinement_net = observed
+            quantization.calibrate(self, calibration_data, self.opt.calibration_size)
+            self.refinement_net = quantization.convert_static(observed)
+            print('AttU_Net calibrated on %d batches' % self.opt.calibration_size)
+
+        for network, label in ((self.netA, labels['A']), (self.netG, labels['G']), (self.refinement_net, labels['R'])):
+            if label not in loaded:
+                # a read-only checkpoint directory only costs the calibration of the next run
+                try:
+                    self.save_network(network, label, which_epoch, self.gpu_ids)
+                except OSError as e:
+                    print('%s not saved: %s' % (label, e))
+        # the int8 weights are hashed on next use
+        self._checkpoint_id = None
+        print('networks quantized to int8%s' % (', loaded ' + ', '.join(loaded) if loaded else ''))
+
+    @property
+    def checkpoint_id(self):
+        # identifies the weights in the run manifest of test.py, whichever files they were loaded
+        # from; hashing all five networks takes a moment, so it only happens when it is needed
+        if self._checkpoint_id is None:
+            from .flow_cache import state_hash
+            self._checkpoint_id = state_hash(self.netG, self.Dual_Att, self.Mapping, self.netA, self.refinement_net)
+        return self._checkpoint_id
+
     def set_input(self, input):
         AtoB = self.opt.which_direction == 'AtoB'
 
-        self.input_A.resize_(input['A'].size()).copy_(input['A'])
-        self.input_B.resize_(input['B'].size()).copy_(input['B'])
+        self.input_A.resize_(input['A'].size()).copy_(input['A'], non_blocking=True)
+        self.input_B.resize_(input['B'].size()).copy_(input['B'], non_blocking=True)
         self.image_paths = input['A_paths' if AtoB else 'B_paths']
+        if self.recorder is not None:
+            self.recorder.tags['paths'] = list(self.image_paths)
 
     # get image paths
     def get_image_paths(self):
         return self.image_paths
 
-    def predict(self):
+    def set_recorder(self, recorder, detail=False):
+        """Records a span for every network call through a StageRecorder, None switches it off.
+
+        Spans are named after the stages mapping, flow, fuse, swin and refine and carry the image
+        paths of the batch as tags. With detail, the GMFlow backbone, transformer, correlation,
+        propagation and convex upsampler get spans of their own, flow.<name>, nested in flow.
+        """
+        if self.recorder is not None:
+            self.recorder.detach()
+        flow_net = networks.get_module(self.netA).flow_net
+        flow_net.recorder = recorder if detail else None
+        if recorder is not None and detail:
+            for name, module in (('backbone', flow_net.backbone), ('transformer', flow_net.transformer),
+                                 ('propagation', flow_net.feature_flow_attn), ('upsampler', flow_net.upsampler)):
+                recorder.attach(module, 'flow.' + name)
+        self.recorder = recorder
+
+    def run_stage(self, stage, func, *args, **kwargs):
+        """Calls a network of the given stage under its precision policy.
+
+        Stages listed in --precision_stages run under autocast with --mixed_precision, except for
+        the matching, flow propagation and flow upsampling inside GMFlow, which stay in fp32.
+        Outputs are returned in fp32, so every stage can be switched on its own. The call is
+        recorded as a span when a recorder is set.
+        """
+        if self.recorder is not None:
+            with self.recorder.span(stage, args) as span:
+                span.outputs = self.run_precision(stage, func, *args, **kwargs)
+            return span.outputs
+        return self.run_precision(stage, func, *args, **kwargs)
+
+    def run_precision(self, stage, func, *args, **kwargs):
+        if stage not in self.precision_stages:
+            return func(*args, **kwargs)
+        gmflow_utils.autocast_depth += 1
+        try:
+            with torch.autocast(self.device.type, dtype=self.precision_dtype):
+                outputs = func(*args, **kwargs)
+        finally:
+            gmflow_utils.autocast_depth -= 1
+        return to_float(outputs)
+
+    def fuse(self, align_B, identity_A):
         up = nn.Upsample(scale_factor=2, mode='bilinear', align_corners=True)
-        with torch.no_grad():
-            self.identity_A, self.correct_A = self.Mapping.forward(self.input_A)
-            self.identity_B, self.correct_B = self.Mapping.forward(self.input_B)
+        self.align_B, self.align_A = self.run_stage('fuse', self.Dual_Att.forward, align_B, identity_A)
 
-            self.align_B, self.f_w, self.f_s = self.netA.forward(self.correct_B, self.correct_A, self.identity_B)
+        self.align_B_half = self.avg_pool(self.align_B)
+        self.align_A_half = self.avg_pool(self.align_A)
 
-            self.align_B, self.align_A = self.Dual_Att.forward(self.align_B, self.identity_A)
-            self.img_level = flow_warp2(self.input_B, self.f_w[-1].permute(0, 2, 3, 1))
+        self.o_lf, self.x_lf = self.run_stage('swin', self.netG.forward, self.align_B_half, self.align_A_half)
+        self.o_lf = up(self.o_lf)
+        self.x_lf = up(self.x_lf)
+        self.detail = self.run_stage('refine', self.refinement_net.forward, self.align_B, self.align_A, self.x_lf)
+        return self.detail + self.o_lf
 
-            self.align_B_half = self.avg_pool(self.align_B)
-            self.align_A_half = self.avg_pool(self.align_A)
+    def predict(self):
+        if self.opt.tile_size > 0:
+            return self.predict_tiled()
+        if self.opt.compile:
+            return self.predict_compiled()
 
-            self.o_lf, self.x_lf = self.netG.forward(self.align_B_half, self.align_A_half)
-            self.o_lf = up(self.o_lf)
-            self.x_lf = up(self.x_lf)
-            self.detail = self.refinement_net.forward(self.align_B, self.align_A, self.x_lf)
-            self.refinement = self.detail + self.o_lf
+        with torch.no_grad():
+            # both exposures in one pass, InstanceNorm2d statistics stay per sample
+            identity, correct = self.run_stage('mapping', self.Mapping.forward,
+                                               torch.cat((self.input_A, self.input_B), dim=0))
+            self.identity_A, self.identity_B = identity.chunk(chunks=2, dim=0)
+            self.correct_A, self.correct_B = correct.chunk(chunks=2, dim=0)
+
+            if self.opt.sequence:
+                # a warm-started flow depends on the previous frames, not only on this pair, and
+                # match_confidence and scene_cut must describe this frame: no flow cache here
+                keys, flow = None, self.estimate_flow_sequence()
+            else:
+                keys, flow = self.load_cached_flow(self.input_A, self.input_B)
+            if flow is None:
+                self.align_B, self.f_w, self.f_s = self.run_stage('flow', self.netA.forward,
+                                                                  self.correct_B, self.correct_A, self.identity_B)
+                self.store_cached_flow(keys, self.f_w[-1])
+            else:
+                # cached or warm-started flow, the rest of the flow network is skipped
+                self.f_w, self.f_s = [flow], None
+                self.align_B = networks.flow_warp2(self.identity_B, flow.permute(0, 2, 3, 1))
+            self.prev_flow = self.f_w[-1]
+            self.img_level = networks.flow_warp2(self.input_B, self.f_w[-1].permute(0, 2, 3, 1))
+
+            self.refinement = self.fuse(self.align_B, self.identity_A)
             output = latent2im(self.refinement.data)
-        return output
+        # one uint8 image per batch element
+        return list(output)
+
+    def share_memory(self):
+        # moves the network weights to shared memory, processes forked afterwards use one copy of them
+        for network in (self.Mapping, self.netA, self.Dual_Att, self.netG, self.refinement_net):
+            network.share_memory()
+
+    def pipeline(self):
+        # the five networks as one module that can be exported or compiled, see models/pipeline.py
+        from .pipeline import MERFPipeline
+        return MERFPipeline(self.Mapping, self.netA, self.Dual_Att, self.netG, self.refinement_net).eval()
+
+    def predict_compiled(self):
+        if self.compiled is None:
+            # compiled on first use, after quantize() if it is called, for any size
+            self.compiled = torch.compile(self.pipeline(), dynamic=True)
+        with torch.no_grad():
+            self.refinement = self.compiled(self.input_A, self.input_B)
+            output = latent2im(self.refinement)
+        return list(output)
+
+    def reset_sequence(self):
+        # the next frame starts from global matching, as after a scene cut
+        self.prev_flow = None
+        self.match_confidence = None
+        self.scene_cut = True
+
+    def estimate_flow_sequence(self):
+        """Flow of the current frame of a burst or video, warm-started from the previous frame.
+
+        Frames must be fed in order with set_input() and predict(). Each frame's flow starts from
+        the previous one and skips global matching, unless the local match confidence falls below
+        --scene_cut_confidence, the frame size changed, or reset_sequence() was called.
+        match_confidence and scene_cut describe the last frame.
+        """
+        prev_flow = self.prev_flow
+        if prev_flow is not None and prev_flow.size()[-2:] != self.correct_A.size()[-2:]:
+            prev_flow = None
+
+        results = self.run_stage('flow', networks.get_module(self.netA).estimate_flow_warm,
+                                 self.correct_B, self.correct_A, prev_flow,
+                                 min_confidence=self.opt.scene_cut_confidence)
+        self.match_confidence = results['match_confidence']
+        self.scene_cut = prev_flow is None or results['warm_start_rejected']
+        return results['flow_preds'][-1]
+
+    def load_cached_flow(self, input_A, input_B, tag=''):
+        # keys of every pair in the batch and their flows, the flows are only returned if all of them hit
+        if self.flow_cache is None:
+            return None, None
+        keys = [self.flow_cache.key(a, b, tag) for a, b in zip(input_A, input_B)]
+        flows = []
+        for key in keys:
+            flow = self.flow_cache.get(key)
+            if flow is None:
+                return keys, None
+            flows.append(flow)
+        return keys, torch.stack(flows).to(self.device)
+
+    def store_cached_flow(self, keys, flow):
+        if self.flow_cache is None:
+            return
+        for key, f in zip(keys, flow):
+            self.flow_cache.put(key, f)
+
+    def estimate_flow_scaled(self, max_size):
+        # flow of the whole image, estimated at a size whose longest side is at most max_size
+        h, w = self.input_A.size()[-2:]
+        size = tiling.scaled_size(h, w, max_size)
+        keys, flow = self.load_cached_flow(self.input_A, self.input_B, tag='%dx%d' % size)
+        if flow is not None:
+            return flow
+
+        if size == (h, w):
+            input_A, input_B = self.input_A, self.input_B
+        else:
+            input_A = F.interpolate(self.input_A, size=size, mode='area')
+            input_B = F.interpolate(self.input_B, size=size, mode='area')
+
+        _, correct = self.run_stage('mapping', self.Mapping.forward, torch.cat((input_A, input_B), dim=0))
+        correct_A, correct_B = correct.chunk(chunks=2, dim=0)
+        flow = self.run_stage('flow', networks.get_module(self.netA).estimate_flow, correct_B, correct_A)[-1]
+        self.store_cached_flow(keys, flow)
+        return flow
+
+    def predict_tiled(self):
+        """Tile-by-tile inference for images too large to go through the networks in one piece.
+
+        Flow is estimated once for the whole image at a reduced size (--flow_max_size), then
+        alignment, fusion and refinement run on overlapping tiles of --tile_size that are blended
+        with feathered weights over --tile_overlap, so network memory does not grow with the image.
+        The AttING identity features are a bias-free 1x1 convolution of the input, which commutes
+        with bilinear warping, so each tile samples the over-exposed input from the full image and
+        is aligned exactly as on the whole image.
+
+        Tolerance against predict(): images that fit one tile and --flow_max_size match up to
+        rounding. Tiling itself only changes pixels near tile borders; on test_data, 192-256 pixel
+        tiles with a 32-64 pixel overlap stay above 45 dB PSNR. Estimating flow below full
+        resolution adds an error that depends on the motion in the scene.
+        """
+        tile_size, overlap = self.opt.tile_size, self.opt.tile_overlap
+        assert tile_size % 32 == 0 and overlap % 32 == 0 and overlap < tile_size, \
+            'tile_size and tile_overlap should be multiples of 32 with tile_overlap < tile_size'
+        conv1 = networks.get_module(self.Mapping).conv1
+
+        with torch.no_grad():
+            self.flow = self.estimate_flow_scaled(self.opt.flow_max_size)
+
+            b, _, h, w = self.input_A.size()
+            th, tw = min(tile_size, h), min(tile_size, w)
+            refinement = self.input_A.new_zeros(b, 3, h, w)
+            weight = self.input_A.new_zeros(1, 1, h, w)
+
+            for y0 in tiling.tile_starts(h, tile_size, overlap):
+                for x0 in tiling.tile_starts(w, tile_size, overlap):
+                    flow = tiling.crop_flow(self.flow, y0, x0, th, tw, h, w)
+                    identity_A = self.run_stage('mapping', conv1, self.input_A[:, :, y0:y0 + th, x0:x0 + tw])
+                    align_B = self.run_stage('mapping', conv1, tiling.warp_tile(self.input_B, flow, y0, x0))
+
+                    tile_weight = tiling.feather_weight(y0, th, h, overlap)[:, None] * \
+                                  tiling.feather_weight(x0, tw, w, overlap)[None, :]
+                    tile_weight = tile_weight.to(refinement.device)[None, None]
+                    refinement[:, :, y0:y0 + th, x0:x0 + tw] += self.fuse(align_B, identity_A) * tile_weight
+                    weight[:, :, y0:y0 + th, x0:x0 + tw] += tile_weight
+
+            self.refinement = refinement / weight
+            output = latent2im(self.refinement)
+        return list(output)
@@ -1,10 +1,38 @@
 import math
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.utils.checkpoint as checkpoint
-from timm.models.layers import DropPath, to_2tuple, trunc_normal_
+from torch.nn.init import trunc_normal_
 import torch.nn.init as init
+from models.gmflow.geometry import is_tracing
+
+
+def to_2tuple(x):
+    if isinstance(x, Iterable) and not isinstance(x, str):
+        return tuple(x)
+    return (x, x)
+
+
+def drop_path(x, drop_prob=0., training=False):
+    # stochastic depth: drops the whole residual branch of random samples while training
+    if drop_prob == 0. or not training:
+        return x
+    keep_prob = 1 - drop_prob
+    shape = (x.shape[0],) + (1,) * (x.ndim - 1)
+    return x * x.new_empty(shape).bernoulli_(keep_prob).div_(keep_prob)
+
+
+class DropPath(nn.Module):
+    def __init__(self, drop_prob=0.):
+        super(DropPath, self).__init__()
+        self.drop_prob = drop_prob
+
+    def forward(self, x):
+        return drop_path(x, self.drop_prob, self.training)
 
 
 class Mlp(nn.Module):
@@ -104,10 +132,49 @@ class WindowAttention(nn.Module):
         return x
 
 
+class AttnMaskCache(object):
+    """Bounded LRU cache of shifted-window attention masks, keyed by resolution and device.
+
+    One instance is shared by the blocks of a BasicLayer, so a stream of same-size
+    images builds each mask once instead of once per block per image.
+    """
+
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self.masks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        if is_tracing():
+            return build()
+        with self.lock:
+            mask = self.masks.get(key)
+            if mask is not None:
+                self.masks.move_to_end(key)
+                return mask
+        mask = build()
+        with self.lock:
+            self.masks[key] = mask
+            while len(self.masks) > self.max_size:
+                self.masks.popitem(last=False)
+        return mask
+
+    def clear(self):
+        with self.lock:
+            self.masks.clear()
+
+    # locks cannot be copied or pickled, copies start with an empty cache
+    def __getstate__(self):
+        return {'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_size'])
+
+
 class SwinTransformerBlock(nn.Module):
     def __init__(self, dim, input_resolution, num_heads, window_size=7, shift_size=0,
                  mlp_ratio=4., qkv_bias=True, qk_scale=None, drop=0., attn_drop=0., drop_path=0.,
-                 act_layer=nn.GELU, norm_layer=nn.LayerNorm):
+                 act_layer=nn.GELU, norm_layer=nn.LayerNorm, attn_mask_cache=None):
         super().__init__()
         self.dim = dim
         self.input_resolution = input_resolution
@@ -139,6 +206,16 @@ class SwinTransformerBlock(nn.Module):
             attn_mask = None
 
         self.register_buffer("attn_mask", attn_mask)
+        self.attn_mask_cache = attn_mask_cache if attn_mask_cache is not None else AttnMaskCache()
+
+    def get_mask(self, x_size, device):
+        if self.shift_size == 0:
+            # without a shift every window is a single region, the mask would be all zeros
+            return None
+        if self.input_resolution == x_size:
+            return self.attn_mask
+        key = (x_size[0], x_size[1], self.window_size, self.shift_size, str(device))
+        return self.attn_mask_cache.get(key, lambda: self.calculate_mask(x_size).to(device))
 
     def calculate_mask(self, x_size):
         H, W = x_size
@@ -179,10 +256,7 @@ class SwinTransformerBlock(nn.Module):
         x_windows = window_partition(shifted_x, self.window_size)
         x_windows = x_windows.view(-1, self.window_size * self.window_size, C)
 
-        if self.input_resolution == x_size:
-            attn_windows = self.attn(x_windows, mask=self.attn_mask)
-        else:
-            attn_windows = self.attn(x_windows, mask=self.calculate_mask(x_size).to(x.device))
+        attn_windows = self.attn(x_windows, mask=self.get_mask(x_size, x.device))
 
         attn_windows = attn_windows.view(-1, self.window_size, self.window_size, C)
         shifted_x = window_reverse(attn_windows, self.window_size, H, W)
@@ -240,6 +314,7 @@ class BasicLayer(nn.Module):
         self.input_resolution = input_resolution
         self.depth = depth
         self.use_checkpoint = use_checkpoint
+        self.attn_mask_cache = AttnMaskCache()
 
         self.blocks = nn.ModuleList([
             SwinTransformerBlock(dim=dim, input_resolution=input_resolution,
@@ -249,7 +324,8 @@ class BasicLayer(nn.Module):
                                  qkv_bias=qkv_bias, qk_scale=qk_scale,
                                  drop=drop, attn_drop=attn_drop,
                                  drop_path=drop_path[i] if isinstance(drop_path, list) else drop_path,
-                                 norm_layer=norm_layer)
+                                 norm_layer=norm_layer,
+                                 attn_mask_cache=self.attn_mask_cache)
             for i in range(depth)])
 
         if downsample is not None:
@@ -0,0 +1,76 @@
+import torch
+import torch.nn.functional as F
+from models.gmflow.geometry import pixel_grid
+
+
+def tile_starts(size, tile_size, overlap):
+    # tiles of tile_size stepping by tile_size - overlap, the last one aligned to the border
+    if size <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    return list(range(0, size - tile_size, stride)) + [size - tile_size]
+
+
+def feather_weight(start, length, size, overlap):
+    # 1-d blending weight of a tile, ramping up over the overlap on every side that has a neighbour
+    weight = torch.ones(length)
+    if overlap > 0:
+        ramp = torch.arange(1, overlap + 1, dtype=torch.float32) / (overlap + 1)
+        if start > 0:
+            weight[:overlap] = ramp
+        if start + length < size:
+            weight[-overlap:] = torch.min(weight[-overlap:], ramp.flip(0))
+    return weight
+
+
+def scaled_size(h, w, max_size):
+    # size used for global flow estimation, longest side at most max_size and a multiple of 32
+    scale = max(h, w) / float(max_size)
+    if scale <= 1:
+        return h, w
+    return max(32, int(round(h / scale / 32.)) * 32), max(32, int(round(w / scale / 32.)) * 32)
+
+
+def crop_flow(flow, y0, x0, th, tw, h, w):
+    """Full-resolution flow of a tile from a flow estimated at a possibly reduced resolution.
+
+    Args:
+        flow (Tensor): [B, 2, hs, ws] flow in pixels of the reduced resolution.
+        y0, x0, th, tw (int): tile position and size at full resolution.
+        h, w (int): full resolution.
+
+    Returns:
+        Tensor: [B, 2, th, tw] flow in full-resolution pixels.
+    """
+    b, _, hs, ws = flow.size()
+    if (hs, ws) == (h, w):
+        return flow[:, :, y0:y0 + th, x0:x0 + tw]
+
+    # bilinear sampling with align_corners=True, as GMFlow upsamples its own flow
+    grid = pixel_grid(th, tw, device=flow.device, dtype=flow.dtype)
+    grid_x = 2.0 * (grid[..., 0] + x0) / max(w - 1, 1) - 1.0
+    grid_y = 2.0 * (grid[..., 1] + y0) / max(h - 1, 1) - 1.0
+    grid = torch.stack((grid_x, grid_y), dim=3).expand(b, -1, -1, -1)
+    tile_flow = F.grid_sample(flow, grid, mode='bilinear', padding_mode='border', align_corners=True)
+
+    scale = flow.new_tensor([(w - 1) / max(ws - 1, 1.), (h - 1) / max(hs - 1, 1.)]).view(1, 2, 1, 1)
+    return tile_flow * scale
+
+
+def warp_tile(x, flow, y0, x0):
+    """Warp the tile at (y0, x0) of a full image, as flow_warp2 would on the whole image.
+
+    Args:
+        x (Tensor): [B, C, H, W] full image.
+        flow (Tensor): [B, 2, th, tw] flow of the tile in full-resolution pixels.
+
+    Returns:
+        Tensor: [B, C, th, tw] warped tile, sampled from anywhere in x.
+    """
+    h, w = x.size()[-2:]
+    th, tw = flow.size()[-2:]
+    vgrid = pixel_grid(th, tw, device=x.device, dtype=x.dtype) + flow.permute(0, 2, 3, 1)
+    vgrid_x = 2.0 * (vgrid[:, :, :, 0] + x0) / max(w - 1, 1) - 1.0
+    vgrid_y = 2.0 * (vgrid[:, :, :, 1] + y0) / max(h - 1, 1) - 1.0
+    vgrid_scaled = torch.stack((vgrid_x, vgrid_y), dim=3)
+    return F.grid_sample(x, vgrid_scaled, mode='bilinear', padding_mode='zeros', align_corners=True)
@@ -0,0 +1,95 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+import torch
+
+# file layout: MAGIC, the JSON index length as a little-endian uint64, the JSON index, then the raw
+# tensor bytes from the next multiple of ALIGNMENT, each tensor starting on a multiple of ALIGNMENT
+MAGIC = b'MERFWB01'
+ALIGNMENT = 64
+
+
+def bundle_path(save_dir, epoch_label):
+    return os.path.join(save_dir, '%s_nets.bundle' % epoch_label)
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def tensor_bytes(tensor):
+    # the bytes of a tensor as a uint8 numpy array, without a copy for contiguous CPU tensors
+    return tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+
+
+def save_bundle(state_dicts, path):
+    """Writes several state dicts to one file that load_bundle() memory-maps.
+
+    state_dicts maps a network label to its state dict. Every tensor is stored with its dtype,
+    shape, offset, size and CRC-32 in a JSON index, followed by the raw bytes. The file is written
+    next to path and renamed, so a reader never sees half a bundle.
+    """
+    index = OrderedDict()
+    blobs = []
+    offset = 0
+    for label, state_dict in state_dicts.items():
+        tensors = OrderedDict()
+        for key, tensor in state_dict.items():
+            data = tensor_bytes(tensor)
+            tensors[key] = [str(tensor.dtype).replace('torch.', ''), list(tensor.shape), offset, data.nbytes,
+                            zlib.crc32(data)]
+            blobs.append((offset, data))
+            offset = align(offset + data.nbytes)
+        metadata = getattr(state_dict, '_metadata', None)
+        index[label] = {'tensors': tensors, 'metadata': metadata if metadata is not None else {}}
+    header = json.dumps({'networks': index}).encode('utf-8')
+    start = align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for blob_offset, data in blobs:
+            f.seek(start + blob_offset)
+            f.write(data.data)
+        f.truncate(start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_bundle(path, verify=True):
+    """State dicts of a bundle written by save_bundle(), by network label.
+
+    The tensors are views into a private memory map of the file: nothing is unpickled or copied,
+    pages are read on first use and shared through the page cache by every process that maps the
+    same file, until one of them writes to a tensor. With verify, every tensor is checked against
+    its CRC-32 and a ValueError names the first one that does not match.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a weight bundle' % path)
+    length, = struct.unpack_from('<Q', mapped, len(MAGIC))
+    header = json.loads(mapped[len(MAGIC) + 8:len(MAGIC) + 8 + length].decode('utf-8'))
+    start = align(len(MAGIC) + 8 + length)
+
+    state_dicts = OrderedDict()
+    for label, network in header['networks'].items():
+        state_dict = OrderedDict()
+        for key, (dtype, shape, offset, nbytes, crc) in network['tensors'].items():
+            if verify:
+                with memoryview(mapped) as view, view[start + offset:start + offset + nbytes] as data:
+                    if zlib.crc32(data) != crc:
+                        raise ValueError('%s is corrupted: checksum mismatch for %s.%s' % (path, label, key))
+            dtype = getattr(torch, dtype)
+            if nbytes == 0:
+                state_dict[key] = torch.empty(shape, dtype=dtype)
+                continue
+            data = torch.frombuffer(mapped, dtype=torch.uint8, count=nbytes, offset=start + offset)
+            state_dict[key] = data.view(dtype).view(shape)
+        state_dict._metadata = OrderedDict(network['metadata'])
+        state_dicts[label] = state_dict
+    return state_dicts
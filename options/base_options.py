@@ -1,15 +1,17 @@
 import argparse
 import os
-from util import util
 import torch
 
 class BaseOptions():
+    # entry points that do not read a dataset directory turn this off
+    dataroot_required = True
+
     def __init__(self):
         self.parser = argparse.ArgumentParser()
         self.initialized = False
 
     def initialize(self):
-        self.parser.add_argument('--dataroot', required=True, help='path to images (should have subfolders trainA, trainB, valA, valB, etc)')
+        self.parser.add_argument('--dataroot', required=self.dataroot_required, help='path to images (should have subfolders trainA, trainB, valA, valB, etc)')
         self.parser.add_argument('--batchSize', type=int, default=1, help='input batch size')
         self.parser.add_argument('--loadSize', type=int, default=286, help='scale images to this size')
         self.parser.add_argument('--fineSize', type=int, default=256, help='then crop to this size')
@@ -23,12 +25,14 @@ class BaseOptions():
         self.parser.add_argument('--n_layers_D', type=int, default=3, help='only used if which_model_netD==n_layers')
         self.parser.add_argument('--n_layers_patchD', type=int, default=3, help='only used if which_model_netD==n_layers')
         self.parser.add_argument('--gpu_ids', type=str, default='0', help='gpu ids: e.g. 0  0,1,2, 0,2. use -1 for CPU')
+        self.parser.add_argument('--device', type=str, default='', help='device to run on: cpu, cuda, cuda:1. defaults to the first of gpu_ids when CUDA is available, otherwise cpu')
         self.parser.add_argument('--name', type=str, default='Final', help='name of the experiment. It decides where to store samples and models')
         self.parser.add_argument('--dataset_mode', type=str, default='test', help='chooses how datasets are loaded. [unaligned | aligned | single]')
         self.parser.add_argument('--model', type=str, default='cycle_gan',
                                  help='chooses which model to use. cycle_gan, pix2pix, test')
         self.parser.add_argument('--which_direction', type=str, default='AtoB', help='AtoB or BtoA')
         self.parser.add_argument('--nThreads', default=0, type=int, help='# threads for loading data')
+        self.parser.add_argument('--prefetch', default=2, type=int, help='# batches prepared ahead of the one being processed, 0 loads them on demand')
         self.parser.add_argument('--checkpoints_dir', type=str, default='./checkpoints', help='models are saved here')
         self.parser.add_argument('--norm', type=str, default='instance', help='instance normalization or batch normalization')
         self.parser.add_argument('--serial_batches', action='store_true', help='if true, takes images in order to make batches, otherwise takes them randomly')
@@ -88,8 +92,17 @@ class BaseOptions():
         self.parser.add_argument('--denoise', type=int, default=0, help='denoise or not')
         self.parser.add_argument('--small', action='store_true', help='use small model')
         self.parser.add_argument('--mixed_precision', action='store_true', help='use mixed precision')
+        self.parser.add_argument('--precision_dtype', type=str, default='bf16', help='reduced precision of --mixed_precision [bf16|fp16]')
+        self.parser.add_argument('--precision_stages', type=str, default='flow,swin,refine',
+                                 help='stages run in reduced precision with --mixed_precision, comma separated from mapping,flow,fuse,swin,refine')
         self.parser.add_argument('--alternate_corr', action='store_true',
                                  help='use efficent correlation implementation')
+        self.parser.add_argument('--flow_cache_dir', type=str, default='', help='cache estimated flows in this directory as uncompressed float16 .npy files, keyed by input content and weights')
+        self.parser.add_argument('--flow_cache_size', type=int, default=1024, help='size limit of the flow cache in MB, least recently used flows are evicted')
+        self.parser.add_argument('--weights_bundle', type=str, default='',
+                                 help='load every network from this bundle written by bundle_weights.py, defaults to <epoch>_nets.bundle in the checkpoint directory when it exists')
+        self.parser.add_argument('--corr_chunk_size', type=int, default=0,
+                                 help='compute global correlation and propagation in blocks of this many pixels to bound memory, 0 for the dense version')
         self.initialized = True
 
     def parse(self):
@@ -107,9 +120,23 @@ class BaseOptions():
             if id >= 0:
                 self.opt.gpu_ids.append(id)
         
-        # set gpu ids
-        if len(self.opt.gpu_ids) > 0:
-            torch.cuda.set_device(self.opt.gpu_ids[0])
+        # resolve the device, gpu_ids are only kept when running on CUDA
+        if self.opt.device:
+            device = torch.device(self.opt.device)
+        elif len(self.opt.gpu_ids) > 0 and torch.cuda.is_available():
+            device = torch.device('cuda', self.opt.gpu_ids[0])
+        else:
+            device = torch.device('cpu')
+
+        if device.type == 'cuda':
+            if device.index is None:
+                device = torch.device('cuda', self.opt.gpu_ids[0] if len(self.opt.gpu_ids) > 0 else 0)
+            # the first gpu id is the output device of DataParallel
+            self.opt.gpu_ids = [device.index] + [id for id in self.opt.gpu_ids if id != device.index]
+            torch.cuda.set_device(device)
+        else:
+            self.opt.gpu_ids = []
+        self.opt.device = device
 
         # args = vars(self.opt)
 
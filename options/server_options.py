@@ -0,0 +1,14 @@
+from .test_options import TestOptions
+
+
+class ServerOptions(TestOptions):
+    dataroot_required = False
+
+    def initialize(self):
+        TestOptions.initialize(self)
+        self.parser.add_argument('--host', type=str, default='127.0.0.1', help='address the server listens on')
+        self.parser.add_argument('--port', type=int, default=8000, help='port the server listens on')
+        self.parser.add_argument('--max_batch', type=int, default=4, help='most pairs of the same padded size fused in one predict() call')
+        self.parser.add_argument('--max_latency', type=float, default=20, help='ms a pair waits for others of its size before its batch runs')
+        self.parser.add_argument('--max_queue', type=int, default=64, help='pairs waiting for inference beyond which requests are refused with 503')
+        self.parser.add_argument('--max_request_size', type=int, default=64, help='largest request body in MB')
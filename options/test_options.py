@@ -10,4 +10,29 @@ class TestOptions(BaseOptions):
         self.parser.add_argument('--phase', type=str, default='test', help='train, val, test, etc')
         self.parser.add_argument('--which_epoch', type=str, default='latest', help='which epoch to load? set to latest to use latest cached model')
         self.parser.add_argument('--how_many', type=int, default=50, help='how many test images to run')
+        self.parser.add_argument('--tile_size', type=int, default=0, help='run fusion and refinement on tiles of this size (multiple of 32), 0 processes the whole image at once')
+        self.parser.add_argument('--tile_overlap', type=int, default=64, help='overlap between neighbouring tiles (multiple of 32), blended with feathered weights')
+        self.parser.add_argument('--flow_max_size', type=int, default=1024, help='longest side of the image used for flow estimation in tiled inference')
+        self.parser.add_argument('--save_workers', type=int, default=2, help='threads encoding and writing output images, 0 writes them synchronously')
+        self.parser.add_argument('--save_queue', type=int, default=8, help='max output images waiting to be written before inference blocks')
+        self.parser.add_argument('--output_format', type=str, default='png', help='format of output images [png|jpg|bmp|tiff|webp]')
+        self.parser.add_argument('--png_compress_level', type=int, default=6, help='zlib level of png outputs, 0 (fastest) to 9 (smallest)')
+        self.parser.add_argument('--jpeg_quality', type=int, default=95, help='quality of jpg and webp outputs')
+        self.parser.add_argument('--sequence', action='store_true', help='treat the pairs as consecutive frames of a burst or video and warm-start each flow from the previous frame, without the flow cache or --tile_size')
+        self.parser.add_argument('--scene_cut_confidence', type=float, default=0.3, help='in sequence mode, mean best-match probability below which a frame is a scene cut and is matched globally')
+        self.parser.add_argument('--quantize', action='store_true', help='int8 CPU inference: dynamic for the transformer Linear layers, static for AttU_Net')
+        self.parser.add_argument('--calibration_dataroot', type=str, default='', help='pairs used to calibrate static int8 quantization, defaults to dataroot')
+        self.parser.add_argument('--calibration_size', type=int, default=16, help='# of batches used to calibrate static int8 quantization')
+        self.parser.add_argument('--compile', action='store_true', help='run the networks as one module through torch.compile')
+        self.parser.add_argument('--export_format', type=str, default='export', help='format written by export.py [export|torchscript], torchscript is fixed to --export_size')
+        self.parser.add_argument('--export_path', type=str, default='', help='file written by export.py, defaults to merf.pt2 or merf.pt in the checkpoint directory')
+        self.parser.add_argument('--export_size', type=str, default='384x576', help='HxW of the example inputs used by export.py, multiples of 32')
+        self.parser.add_argument('--stage_log', type=str, default='', help='append the time, CPU time, peak memory and tensor shapes of every network call to this JSONL file')
+        self.parser.add_argument('--stage_metrics', type=str, default='', help='write per-stage totals to this file in the Prometheus text format')
+        self.parser.add_argument('--stage_detail', action='store_true', help='also record the GMFlow backbone, transformer, correlation, propagation and upsampler')
+        self.parser.add_argument('--workers', type=int, default=1, help='split the pairs across this many processes, each pinned to its own cores, sharing one copy of the networks')
+        self.parser.add_argument('--output_dir', type=str, default='./Test/', help='fused images are written here, named after their under-exposed input, with a manifest.jsonl of the run')
+        self.parser.add_argument('--resume', action='store_true', help='skip the pairs whose output in the manifest matches the current inputs, weights and options')
+        self.parser.add_argument('--index_cache', type=str, default='', help='file caching the pairs of dataroot/low and dataroot/high, defaults to dataroot/.pair_index.json, or to ~/.cache/merf when dataroot is read-only')
+        self.parser.add_argument('--no_index_cache', action='store_true', help='list dataroot on every run instead of caching the pair index')
         self.isTrain = False
@@ -0,0 +1,88 @@
+"""Compares reduced-precision or int8 inference against fp32 on a test set.
+
+The dataset is run once in fp32 and once with the precision or quantization options given on
+the command line, each in a fresh process. The report lists the PSNR of every output against
+the fp32 one, the median latency per batch and the peak memory above the size after loading.
+The flow cache is not used, so that every configuration estimates its own flows.
+
+    python precision_report.py --dataroot test_data --mixed_precision --precision_stages flow,swin,refine
+    python precision_report.py --dataroot test_data --quantize --calibration_dataroot calibration_data
+"""
+import copy
+import multiprocessing
+import time
+import numpy as np
+
+from options.test_options import TestOptions
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def run(opt):
+    from data.data_loader import CreateDataLoader, CreateCalibrationLoader
+    from models.models import create_model
+    from models.instrumentation import peak_memory, reset_peak_memory, resident_memory
+    dataset = CreateDataLoader(opt).load_data()
+    model = create_model(opt)
+    if opt.quantize:
+        model.quantize(CreateCalibrationLoader(opt))
+
+    outputs, times = {}, []
+    reset_peak_memory(model.device)
+    base_memory = resident_memory(model.device)
+    for data in dataset:
+        start = time.time()
+        model.set_input(data)
+        for index, output in zip(data['index'].tolist(), model.predict()):
+            outputs[index] = output
+        times.append(time.time() - start)
+    # in MB
+    return outputs, float(np.median(times)), (peak_memory(model.device) - base_memory) / 1024. / 1024.
+
+
+def run_isolated(opt):
+    # a fresh process per configuration, so that peak memory and caches are not shared
+    pool = multiprocessing.get_context('spawn').Pool(1)
+    try:
+        return pool.apply(run, (opt,))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def report(configs):
+    # the first configuration is the reference
+    results = [(name, run_isolated(opt)) for name, opt in configs]
+    reference, ref_latency, ref_memory = results[0][1]
+
+    print('%-24s %12s %10s %14s %10s %10s' % ('configuration', 'latency (s)', 'speedup', 'peak mem (MB)',
+                                             'mean PSNR', 'min PSNR'))
+    for name, (outputs, latency, memory) in results:
+        values = [psnr(outputs[index], reference[index]) for index in sorted(reference)]
+        print('%-24s %12.3f %9.2fx %14.1f %10.2f %10.2f' % (name, latency, ref_latency / latency, memory,
+                                                          np.mean(values), np.min(values)))
+    return results
+
+
+if __name__ == '__main__':
+    opt = TestOptions().parse()
+    opt.serial_batches = True  # no shuffle
+    opt.no_flip = True  # no flip
+    # every configuration estimates its own flows, and latencies are not those of cache hits
+    opt.flow_cache_dir = ''
+
+    reference_opt = copy.copy(opt)
+    reference_opt.mixed_precision = False
+    reference_opt.quantize = False
+    configs = [('fp32', reference_opt)]
+    names = []
+    if opt.mixed_precision:
+        names.append('%s %s' % (opt.precision_dtype, opt.precision_stages))
+    if opt.quantize:
+        names.append('int8')
+    if names:
+        configs.append((' + '.join(names), opt))
+    report(configs)
@@ -0,0 +1,265 @@
+"""Local HTTP inference service that keeps SingleModel resident and batches concurrent requests.
+
+    python server.py --name Final --gpu_ids -1 --port 8000 --max_batch 4 --max_latency 20
+    python client.py under.png over.png fused.png --url http://127.0.0.1:8000
+
+POST /fuse takes an exposure pair, either as multipart/form-data with the image files 'A' (under-
+exposed) and 'B' (over-exposed), answered with the fused image in --output_format (or ?format=),
+or as an .npz body (Content-Type application/x-npz) with uint8 [H, W, 3] arrays 'A' and 'B',
+answered with an .npz holding 'fused'. Pairs are padded to a multiple of 32. Pairs of the same
+padded size that arrive within --max_latency ms of the first one are fused in one predict() call,
+up to --max_batch, and the outputs are cropped back to the input size.
+
+GET /health reports the device and counters, GET /queue the pairs waiting and the batch sizes.
+"""
+import io
+import json
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from options.server_options import ServerOptions
+from data.base_dataset import to_tensor
+from data.data_loader import CreateCalibrationLoader
+from models.models import create_model
+from util.image_writer import IMAGE_FORMATS
+
+
+class QueueFull(Exception):
+    pass
+
+
+class PendingPair(object):
+    def __init__(self, input_A, input_B):
+        self.size = input_A.shape[-2:]
+        h, w = self.size
+        # replicate padding to a multiple of 32, the networks downsample five times
+        padding = (0, -w % 32, 0, -h % 32)
+        self.input_A = F.pad(input_A[None], padding, mode='replicate')[0]
+        self.input_B = F.pad(input_B[None], padding, mode='replicate')[0]
+        self.key = tuple(self.input_A.shape)
+        self.arrival = time.time()
+        self.done = threading.Event()
+        self.output = None
+        self.error = None
+
+
+class DynamicBatcher(object):
+    """Runs SingleModel.predict on batches of queued pairs of the same padded size.
+
+    A single thread owns the model. It takes the oldest pair and waits up to max_latency seconds
+    after its arrival for more pairs of its size, then fuses up to max_batch of them at once;
+    pairs of other sizes keep their place in the queue. submit() blocks until its pair is fused
+    and raises QueueFull when max_queue pairs are already waiting.
+    """
+
+    def __init__(self, model, max_batch=4, max_latency=0.02, max_queue=64):
+        self.model = model
+        self.max_batch = max(max_batch, 1)
+        self.max_latency = max_latency
+        self.max_queue = max_queue
+        self.pending = []
+        self.condition = threading.Condition()
+        self.batches = 0
+        self.processed = 0
+        self.batch_sizes = {}
+        self.thread = threading.Thread(target=self.run, name='batcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, input_A, input_B):
+        pair = PendingPair(input_A, input_B)
+        with self.condition:
+            if len(self.pending) >= self.max_queue:
+                raise QueueFull('%d pairs are already waiting' % len(self.pending))
+            self.pending.append(pair)
+            self.condition.notify_all()
+        pair.done.wait()
+        if pair.error is not None:
+            raise pair.error
+        return pair.output
+
+    def queue_depth(self):
+        with self.condition:
+            return len(self.pending)
+
+    def next_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            first = self.pending[0]
+            deadline = first.arrival + self.max_latency
+            while True:
+                batch = [pair for pair in self.pending if pair.key == first.key][:self.max_batch]
+                remaining = deadline - time.time()
+                if len(batch) >= self.max_batch or remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            for pair in batch:
+                self.pending.remove(pair)
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                self.model.set_input({'A': torch.stack([pair.input_A for pair in batch]),
+                                      'B': torch.stack([pair.input_B for pair in batch]),
+                                      'A_paths': ['request'] * len(batch), 'B_paths': ['request'] * len(batch)})
+                for pair, output in zip(batch, self.model.predict()):
+                    h, w = pair.size
+                    pair.output = output[:h, :w]
+            except Exception as e:
+                for pair in batch:
+                    pair.error = e
+            finally:
+                self.batches += 1
+                self.processed += len(batch)
+                self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+                for pair in batch:
+                    pair.done.set()
+
+
+def decode_image(data):
+    return to_tensor(Image.open(io.BytesIO(data)).convert('RGB'))
+
+
+def decode_array(array):
+    # uint8 [H, W, 3] or float [H, W, 3] in [0, 1] to [3, H, W] in [0, 1]
+    array = np.asarray(array)
+    if array.ndim != 3 or array.shape[2] != 3:
+        raise ValueError('arrays should be [H, W, 3], got %s' % (array.shape,))
+    tensor = torch.from_numpy(np.ascontiguousarray(array)).permute(2, 0, 1)
+    return tensor.float().div(255) if array.dtype == np.uint8 else tensor.float()
+
+
+def parse_multipart(content_type, body):
+    # files of a multipart/form-data body by field name
+    message = BytesParser(policy=HTTP).parsebytes(b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    if not message.is_multipart():
+        raise ValueError('expected a multipart/form-data body')
+    return dict((part.get_param('name', header='content-disposition'), part.get_payload(decode=True))
+                for part in message.iter_parts())
+
+
+class FuseHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # set by serve()
+    batcher = None
+    opt = None
+    started = None
+
+    def send_body(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, code, obj):
+        self.send_body(code, json.dumps(obj).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        batcher = self.batcher
+        if path == '/health':
+            self.send_json(200, {'status': 'ok', 'device': str(self.opt.device), 'uptime': time.time() - self.started,
+                                 'processed': batcher.processed, 'batches': batcher.batches})
+        elif path == '/queue':
+            self.send_json(200, {'pending': batcher.queue_depth(), 'max_queue': batcher.max_queue,
+                                 'max_batch': batcher.max_batch, 'max_latency_ms': batcher.max_latency * 1000,
+                                 'batch_sizes': dict((str(k), v) for k, v in sorted(batcher.batch_sizes.items()))})
+        else:
+            self.send_json(404, {'error': 'unknown path %s' % path})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/fuse':
+            self.send_json(404, {'error': 'unknown path %s' % url.path})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if length > self.opt.max_request_size * 1024 * 1024:
+            # the body is left unread, the connection cannot carry another request
+            self.close_connection = True
+            self.send_json(413, {'error': 'request body over %d MB' % self.opt.max_request_size})
+            return
+        body = self.rfile.read(length)
+        content_type = self.headers.get('Content-Type', '')
+
+        try:
+            if content_type.startswith('multipart/form-data'):
+                files = parse_multipart(content_type, body)
+                input_A, input_B = decode_image(files['A']), decode_image(files['B'])
+            else:
+                arrays = np.load(io.BytesIO(body))
+                input_A, input_B = decode_array(arrays['A']), decode_array(arrays['B'])
+            if input_A.shape != input_B.shape:
+                raise ValueError('A is %dx%d but B is %dx%d' % (input_A.shape[1:] + input_B.shape[1:]))
+        except Exception as e:
+            # whatever the body is, failing to decode it is the client's error: a .npy instead of an
+            # .npz raises IndexError, a corrupt archive zipfile.BadZipFile
+            self.send_json(400, {'error': 'bad request: %s: %s' % (type(e).__name__, e)})
+            return
+
+        try:
+            output = self.batcher.submit(input_A, input_B)
+        except QueueFull as e:
+            self.send_json(503, {'error': str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+
+        if content_type.startswith('multipart/form-data'):
+            image_format = parse_qs(url.query).get('format', [self.opt.output_format])[0]
+            if image_format not in IMAGE_FORMATS:
+                self.send_json(400, {'error': 'format [%s] is not supported' % image_format})
+                return
+            pil_format = IMAGE_FORMATS[image_format][0]
+            save_kwargs = {'compress_level': self.opt.png_compress_level} if pil_format == 'PNG' else \
+                {'quality': self.opt.jpeg_quality} if pil_format in ('JPEG', 'WEBP') else {}
+            buffer = io.BytesIO()
+            Image.fromarray(output).save(buffer, format=pil_format, **save_kwargs)
+            self.send_body(200, buffer.getvalue(), Image.MIME.get(pil_format, 'application/octet-stream'))
+        else:
+            buffer = io.BytesIO()
+            np.savez(buffer, fused=output)
+            self.send_body(200, buffer.getvalue(), 'application/x-npz')
+
+
+def serve(opt, model=None):
+    # an HTTP server around model, created from opt when None, call serve_forever() to run it
+    if opt.sequence:
+        raise ValueError('the server fuses unrelated pairs, --sequence is not supported')
+    if model is None:
+        model = create_model(opt)
+        if opt.quantize:
+            # int8 networks saved by an earlier run load without calibration data
+            model.quantize(CreateCalibrationLoader(opt) if opt.dataroot or opt.calibration_dataroot else None)
+    handler = type('Handler', (FuseHandler,), {
+        'batcher': DynamicBatcher(model, opt.max_batch, opt.max_latency / 1000., opt.max_queue),
+        'opt': opt, 'started': time.time()})
+    server = ThreadingHTTPServer((opt.host, opt.port), handler)
+    server.daemon_threads = True
+    print('serving on http://%s:%d' % server.server_address[:2])
+    return server
+
+
+if __name__ == '__main__':
+    opt = ServerOptions().parse()
+    server = serve(opt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
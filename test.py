@@ -1,31 +1,211 @@
+import copy
+import multiprocessing
 import os
+import time
+from queue import Empty
+import torch
 
 from options.test_options import TestOptions
-from data.data_loader import CreateDataLoader
+from data.data_loader import CreateDataLoader, CreateCalibrationLoader
+from data.custom_dataset_data_loader import CreateDataset
 from models.models import create_model
-from PIL import Image
-
-opt = TestOptions().parse()
-opt.nThreads = 0  # test code only supports nThreads = 1
-opt.batchSize = 1  # test code only supports batchSize = 1
-opt.serial_batches = True  # no shuffle
-opt.no_flip = True  # no flip
-
-data_loader = CreateDataLoader(opt)
-dataset = data_loader.load_data()
-model = create_model(opt)
-save_dir = os.path.join("./Test/")
-# test
-print("-------dataset size:   ", len(dataset))
-flag = 0.0
-k = 0
-for i, data in enumerate(dataset):
-    model.set_input(data)
-    output = model.predict()
-    img_path = model.get_image_paths()
-    filename = '{:03d}.png'.format(i + 1)
-    print('process image... %s' % img_path)
-    image_pil = Image.fromarray(output)
-    s_path = os.path.join(save_dir, filename)
-    image_pil.save(s_path)
+from util.image_writer import AsyncImageWriter, IMAGE_FORMATS
+from util.run_manifest import RunManifest, output_options
 
+
+def output_name(opt, path_A, extension):
+    # outputs are named after the under-exposed input, relative to dataroot/low
+    return os.path.splitext(os.path.relpath(path_A, os.path.join(opt.dataroot, 'low')))[0] + extension
+
+
+def open_manifest(opt, model):
+    return RunManifest(os.path.join(opt.output_dir, 'manifest.jsonl'), model.checkpoint_id, output_options(opt))
+
+
+def select_pairs(opt, model):
+    # dataset indices to fuse: all of them, or with --resume those without a valid output in the manifest
+    dataset = CreateDataset(opt)
+    indices = list(range(len(dataset)))
+    if not opt.resume:
+        return indices
+    manifest = open_manifest(opt, model)
+    extension = IMAGE_FORMATS[opt.output_format][1]
+    pending = [i for i in indices if not manifest.is_done(output_name(opt, dataset.A_paths[i], extension),
+                                                          dataset.A_paths[i], dataset.B_paths[i])]
+    print('resume: %d of %d pairs have a valid output, %d left' % (len(indices) - len(pending), len(indices), len(pending)))
+    return pending
+
+
+def test(opt, model, worker=None):
+    """Fuses the pairs of opt.dataroot into opt.output_dir, returns the pair count and times.
+
+    A worker of test_workers() fuses the opt.pair_indices it is given. Every output is recorded in
+    the manifest once it is written, so an interrupted run continues with --resume.
+    """
+    if getattr(opt, 'pair_indices', None) is None and opt.resume:
+        opt = copy.copy(opt)
+        opt.pair_indices = select_pairs(opt, model)
+    data_loader = CreateDataLoader(opt)
+    dataset = data_loader.load_data()
+    recorder = stage_log = None
+    if opt.stage_log or opt.stage_metrics:
+        from models.instrumentation import StageRecorder, JsonlWriter
+        recorder = StageRecorder(opt.device)
+        if opt.stage_log:
+            stage_log = recorder.add_callback(JsonlWriter(opt.stage_log))
+        model.set_recorder(recorder, opt.stage_detail)
+    os.makedirs(opt.output_dir, exist_ok=True)
+    manifest = open_manifest(opt, model)
+    writer = AsyncImageWriter(opt.save_workers, opt.save_queue, opt.output_format,
+                              opt.png_compress_level, opt.jpeg_quality)
+    # test
+    print("-------dataset size:   ", len(data_loader))
+    start = time.time()
+    model_time = 0.0
+    pairs = 0
+    with writer:
+        for i, data in enumerate(dataset):
+            model_start = time.time()
+            model.set_input(data)
+            outputs = model.predict()
+            model_time += time.time() - model_start
+            img_paths = model.get_image_paths()
+            for output, img_path, path_A, path_B in zip(outputs, img_paths, data['A_paths'], data['B_paths']):
+                name = output_name(opt, path_A, writer.extension)
+                if opt.sequence and model.match_confidence is not None:
+                    print('process image... %s (match confidence %.3f%s)' % (
+                        img_path, model.match_confidence.min().item(), ', scene cut' if model.scene_cut else ''))
+                else:
+                    print('process image... %s' % img_path)
+                s_path = os.path.join(opt.output_dir, name)
+                if os.path.dirname(name):
+                    os.makedirs(os.path.dirname(s_path), exist_ok=True)
+                # encoding and writing overlap with the next pair, the manifest entry follows the write
+                writer.submit(output, s_path, lambda _, name=name, path_A=path_A, path_B=path_B:
+                              manifest.add(name, path_A, path_B))
+                pairs += 1
+    manifest.close()
+    if stage_log is not None:
+        stage_log.close()
+    if opt.stage_metrics:
+        recorder.write_prometheus(opt.stage_metrics if worker is None else '%s.%d' % (opt.stage_metrics, worker))
+    total_time = time.time() - start
+    print('%stotal %.2fs: model %.2fs, waiting for input %.2fs (loading %.2fs), waiting for output %.2fs'
+          % ('' if worker is None else '[worker %d] ' % worker, total_time, model_time,
+             dataset.wait_time, dataset.load_time, writer.wait_time))
+    return {'pairs': pairs, 'total': total_time, 'model': model_time}
+
+
+def split(items, parts):
+    # parts contiguous, near-equal slices of items
+    return [items[i * len(items) // parts:(i + 1) * len(items) // parts] for i in range(parts)]
+
+
+def run_worker(opt, model, worker, cores, results):
+    try:
+        os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+        results.put((worker, test(opt, model, worker), None))
+    except BaseException as e:
+        results.put((worker, None, '%s: %s' % (type(e).__name__, e)))
+
+
+def collect_results(processes, results, poll=1.0):
+    """Results posted by the workers by worker index, and the errors of those that failed.
+
+    A worker killed before posting its result, by a signal or the OOM killer, is noticed from
+    its exit code instead of leaving the parent blocked on the queue. The other workers are
+    waited for, their outputs are in the manifest for --resume.
+    """
+    stats, errors = {}, []
+    pending = set(range(len(processes)))
+
+    def receive(timeout):
+        try:
+            worker, result, error = results.get(timeout=timeout)
+        except Empty:
+            return False
+        pending.discard(worker)
+        if error is not None:
+            errors.append('worker %d failed: %s' % (worker, error))
+        stats[worker] = result
+        return True
+
+    while pending:
+        if receive(poll):
+            continue
+        dead = [worker for worker in sorted(pending) if processes[worker].exitcode is not None]
+        # a worker flushes its result before it exits, read what is queued before declaring it lost
+        while receive(0.1):
+            pass
+        for worker in dead:
+            if worker in pending:
+                pending.discard(worker)
+                exitcode = processes[worker].exitcode
+                errors.append('worker %d died %s without a result' % (
+                    worker, 'from signal %d' % -exitcode if exitcode < 0 else 'with exit code %d' % exitcode))
+    return stats, errors
+
+
+def test_workers(opt, model):
+    """Splits the pairs, or those left by --resume, into --workers contiguous shards fused by forked processes.
+
+    Every worker is pinned to its own share of the cores available to this process and runs as
+    many torch threads. The network weights are moved to shared memory before forking, so the
+    workers use one copy of them. Outputs keep the names of a single-process run and every worker
+    appends to the same manifest.
+    """
+    if opt.device.type != 'cpu':
+        raise ValueError('--workers runs on CPU, forked processes cannot share a CUDA context')
+    pair_indices = select_pairs(opt, model)
+    available = sorted(os.sched_getaffinity(0))
+    if opt.workers <= len(available):
+        core_sets = split(available, opt.workers)
+    else:
+        core_sets = [[available[i % len(available)]] for i in range(opt.workers)]
+    shards = split(pair_indices, opt.workers)
+    model.share_memory()
+    # hashed once here rather than in every worker
+    model.checkpoint_id
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = []
+    start = time.time()
+    for worker, (cores, shard) in enumerate(zip(core_sets, shards)):
+        worker_opt = copy.copy(opt)
+        worker_opt.pair_indices = shard
+        print('[worker %d] %d pairs on cores %s' % (worker, len(shard), ','.join(map(str, cores))))
+        process = context.Process(target=run_worker, args=(worker_opt, model, worker, cores, results))
+        process.start()
+        processes.append(process)
+
+    stats, errors = collect_results(processes, results)
+    for process in processes:
+        process.join()
+    if errors:
+        raise RuntimeError('; '.join(errors))
+
+    total_time = time.time() - start
+    pairs = sum(result['pairs'] for result in stats.values())
+    print('%d pairs in %.2fs with %d workers: %.3f pairs/s, %.2fs model time per pair and worker'
+          % (pairs, total_time, opt.workers, pairs / total_time,
+             sum(result['model'] for result in stats.values()) / max(pairs, 1)))
+    return stats
+
+
+if __name__ == '__main__':
+    opt = TestOptions().parse()
+    opt.serial_batches = True  # no shuffle
+    opt.no_flip = True  # no flip
+
+    if opt.workers > 1:
+        # a parent that has run OpenMP parallel regions cannot fork safely, it only loads the networks
+        torch.set_num_threads(1)
+    model = create_model(opt)
+    if opt.quantize:
+        model.quantize(CreateCalibrationLoader(opt))
+    if opt.workers > 1:
+        test_workers(opt, model)
+    else:
+        test(opt, model)
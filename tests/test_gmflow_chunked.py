@@ -0,0 +1,34 @@
+import torch
+from models.gmflow.matching import global_correlation_softmax
+from models.gmflow.transformer import FeatureFlowAttention
+
+# does not divide H * W = 16 * 20, so every loop of chunked_softmax_matmul ends on a partial block
+CHUNK_SIZE = 97
+
+
+def features(b=2, c=128, h=16, w=20):
+    # scaled so that the matching softmax is peaked, as with trained features
+    return torch.randn(b, c, h, w) * 2, torch.randn(b, c, h, w) * 2
+
+
+def test_chunked_global_correlation_matches_dense():
+    torch.manual_seed(0)
+    feature0, feature1 = features()
+    for pred_bidir_flow in (False, True):
+        dense, prob = global_correlation_softmax(feature0, feature1, pred_bidir_flow)
+        chunked, chunked_prob = global_correlation_softmax(feature0, feature1, pred_bidir_flow, chunk_size=CHUNK_SIZE)
+        assert prob is not None and chunked_prob is None
+        assert chunked.shape == dense.shape == (4 if pred_bidir_flow else 2, 2, 16, 20)
+        assert torch.allclose(chunked, dense, rtol=1e-4, atol=1e-4)
+
+
+def test_chunked_feature_flow_attention_matches_dense():
+    torch.manual_seed(0)
+    attention = FeatureFlowAttention(in_channels=128).eval()
+    feature0, _ = features()
+    flow = torch.randn(2, 2, 16, 20) * 10
+    with torch.no_grad():
+        dense = attention(feature0, flow)
+        chunked = attention(feature0, flow, chunk_size=CHUNK_SIZE)
+    assert chunked.shape == dense.shape
+    assert torch.allclose(chunked, dense, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,26 @@
+import torch
+from models import networks
+
+
+def map_exposures(mapping, input_A, input_B):
+    # as SingleModel.predict: both exposures go through AttING in one call
+    identity, correct = mapping(torch.cat((input_A, input_B), dim=0))
+    return identity.chunk(chunks=2, dim=0) + correct.chunk(chunks=2, dim=0)
+
+
+def test_batched_mapping_matches_per_exposure():
+    # InstanceNorm2d normalizes every sample on its own, so stacking the under- and over-exposed
+    # images must not mix their statistics
+    torch.manual_seed(0)
+    mapping = networks.define_Att().eval()
+    for batch_size in (1, 2):
+        input_A = torch.rand(batch_size, 3, 64, 96) * 0.3
+        input_B = 0.4 + torch.rand(batch_size, 3, 64, 96) * 0.6
+        with torch.no_grad():
+            identity_A, identity_B, correct_A, correct_B = map_exposures(mapping, input_A, input_B)
+            single_A = mapping(input_A)
+            single_B = mapping(input_B)
+        for batched, single in ((identity_A, single_A[0]), (correct_A, single_A[1]),
+                                (identity_B, single_B[0]), (correct_B, single_B[1])):
+            assert batched.shape == single.shape
+            assert torch.allclose(batched, single, rtol=1e-5, atol=1e-6)
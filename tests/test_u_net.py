@@ -0,0 +1,27 @@
+import copy
+import torch
+import torch.nn as nn
+from models.U_net import AttU_Net
+
+
+def test_fuse_for_inference_matches_unfused():
+    torch.manual_seed(0)
+    net = AttU_Net(64 * 3, 3)
+    # running statistics and affine parameters away from their defaults, so that folding is exercised
+    for module in net.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.2, 0.2)
+    net.eval()
+    fused = copy.deepcopy(net).fuse_for_inference()
+    assert not any(isinstance(module, nn.BatchNorm2d) for module in fused.modules())
+
+    inputs = [torch.randn(2, 64, 64, 96) for _ in range(3)]
+    with torch.no_grad():
+        reference = net(*inputs)
+        output = fused(*inputs)
+    assert output.shape == reference.shape
+    assert torch.allclose(output, reference, rtol=1e-4, atol=1e-5 * reference.abs().max().item())
+    assert set(fused.state_dict()) <= set(net.state_dict())
@@ -0,0 +1,85 @@
+import atexit
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+IMAGE_FORMATS = {
+    'png': ('PNG', '.png'),
+    'jpg': ('JPEG', '.jpg'),
+    'jpeg': ('JPEG', '.jpg'),
+    'bmp': ('BMP', '.bmp'),
+    'tiff': ('TIFF', '.tif'),
+    'webp': ('WEBP', '.webp'),
+}
+
+
+class AsyncImageWriter():
+    """Encodes and writes output images on a thread pool while inference carries on.
+
+    PIL releases the GIL while encoding, so the workers overlap with the next forward pass.
+    At most max_pending images are queued or in flight: submit() blocks beyond that, which
+    bounds the memory held by finished frames. A callback given to submit() is called with the
+    path once the image is completely written, on the writing thread. close() (also run at interpreter exit) waits
+    for every write and re-raises the first error. wait_time is the time submit() spent blocked.
+    """
+
+    def __init__(self, num_workers=2, max_pending=8, image_format='png', compress_level=6, quality=95):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError('output format [%s] is not supported, use one of %s'
+                             % (image_format, ', '.join(sorted(IMAGE_FORMATS))))
+        self.format, self.extension = IMAGE_FORMATS[image_format]
+        self.save_kwargs = {}
+        if self.format == 'PNG':
+            self.save_kwargs['compress_level'] = compress_level
+        elif self.format in ('JPEG', 'WEBP'):
+            self.save_kwargs['quality'] = quality
+
+        self.executor = ThreadPoolExecutor(max_workers=num_workers) if num_workers > 0 else None
+        self.slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self.errors = []
+        self.wait_time = 0.0
+        self.closed = False
+        atexit.register(self.close)
+
+    def save(self, image_numpy, path, callback=None):
+        Image.fromarray(image_numpy).save(path, format=self.format, **self.save_kwargs)
+        if callback is not None:
+            callback(path)
+
+    def submit(self, image_numpy, path, callback=None):
+        self.raise_errors()
+        if self.executor is None:
+            self.save(image_numpy, path, callback)
+            return
+        start = time.time()
+        self.slots.acquire()
+        self.wait_time += time.time() - start
+        future = self.executor.submit(self.save, image_numpy, path, callback)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.slots.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def raise_errors(self):
+        if self.errors:
+            error, self.errors = self.errors[0], []
+            raise error
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            atexit.unregister(self.close)
+            if self.executor is not None:
+                start = time.time()
+                self.executor.shutdown(wait=True)
+                self.wait_time += time.time() - start
+        self.raise_errors()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# options that change the fused pixels or the encoded file, --resume redoes pairs fused with other values
+OUTPUT_OPTIONS = ('which_direction', 'tile_size', 'tile_overlap', 'flow_max_size', 'sequence', 'scene_cut_confidence',
+                  'mixed_precision', 'precision_dtype', 'precision_stages', 'alternate_corr', 'corr_chunk_size',
+                  'flow_cache_dir', 'quantize', 'compile', 'output_format', 'png_compress_level', 'jpeg_quality')
+
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def output_options(opt):
+    options = dict((name, getattr(opt, name, None)) for name in OUTPUT_OPTIONS)
+    # cached flows are stored as float16, where the cache lives does not change the output
+    options['flow_cache_dir'] = bool(options['flow_cache_dir'])
+    return options
+
+
+class RunManifest():
+    """JSONL record of the outputs written to a directory, read back by test.py --resume.
+
+    Every line describes one output: its name relative to the directory, size and SHA-1, the
+    paths and SHA-1s of the input pair, the size and mtime of all three files, the checkpoint id
+    and the output options. The latest line of a name wins. A pair is done when that line matches
+    the current checkpoint and options and the three files still have the recorded content; a
+    file is only hashed again when its size or mtime changed. Each line is appended with
+    a single O_APPEND write, so the processes of test.py --workers can share the file, and a line
+    cut short by a crash is ignored.
+    """
+
+    def __init__(self, path, checkpoint_id, options):
+        self.path = path
+        self.root = os.path.dirname(path)
+        self.checkpoint_id = checkpoint_id
+        self.options = options
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    self.records[record['output']] = record
+        self.lock = threading.Lock()
+        self.fd = None
+
+    def is_done(self, name, path_A, path_B):
+        record = self.records.get(name)
+        if record is None or record['checkpoint'] != self.checkpoint_id or record['options'] != self.options:
+            return False
+        output_path = os.path.join(self.root, name)
+        if not os.path.exists(output_path) or os.path.getsize(output_path) != record['size']:
+            return False
+        return (self.unchanged(path_A, record['A_sha1'], record.get('A_stat'))
+                and self.unchanged(path_B, record['B_sha1'], record.get('B_stat'))
+                and self.unchanged(output_path, record['sha1'], record.get('stat')))
+
+    def unchanged(self, path, sha1, stat):
+        try:
+            if file_stat(path) == stat:
+                return True
+            return file_hash(path) == sha1
+        except OSError:
+            return False
+
+    def add(self, name, path_A, path_B):
+        # records the output name, call once the file is completely written
+        output_path = os.path.join(self.root, name)
+        stat = file_stat(output_path)
+        record = {'output': name, 'size': stat[0], 'stat': stat, 'sha1': file_hash(output_path),
+                  'A': path_A, 'A_stat': file_stat(path_A), 'A_sha1': file_hash(path_A),
+                  'B': path_B, 'B_stat': file_stat(path_B), 'B_sha1': file_hash(path_B),
+                  'checkpoint': self.checkpoint_id, 'options': self.options, 'time': time.time()}
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self.lock:
+            if self.fd is None:
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                # end a line cut short by a crash, so that it does not swallow this one
+                if os.fstat(self.fd).st_size > 0:
+                    with open(self.path, 'rb') as f:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b'\n':
+                            os.write(self.fd, b'\n')
+            os.write(self.fd, line)
+            self.records[name] = record
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
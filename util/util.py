@@ -9,7 +9,6 @@ import collections
 from torch.optim import lr_scheduler
 import torch.nn.init as init
 import math
-import cv2
 
 
 # Converts a Tensor into a Numpy array